@@ -0,0 +1,312 @@
+"""Cold storage for old dose history.
+
+Records older than the archive horizon are moved out of the live
+``HealthRecordStore`` into one compressed segment per user and month
+(zlib-compressed BSON), kept either in the ``health_record_archive``
+collection or as files on local disk. ``HealthHistory`` puts the live
+store and the archive behind one read API and only opens segments when a
+query's date range reaches past the horizon. A lease in ``archive_runs``
+keeps several workers from archiving, and merging segments, at once.
+"""
+
+import abc
+import asyncio
+import logging
+import os
+import uuid
+import zlib
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+import bson
+from pymongo import ASCENDING, DESCENDING, ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+from record_store import HealthRecordStore
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_BACKENDS = ("mongo", "files")
+RUN_ID = "archiver"
+
+
+def month_start(moment: datetime) -> datetime:
+    return datetime(moment.year, moment.month, 1)
+
+
+def next_month(moment: datetime) -> datetime:
+    return datetime(moment.year + moment.month // 12, moment.month % 12 + 1, 1)
+
+
+def encode_segment(records: List[Dict[str, Any]]) -> bytes:
+    return zlib.compress(bson.encode({"records": records}), 6)
+
+
+def decode_segment(data: bytes) -> List[Dict[str, Any]]:
+    return bson.decode(zlib.decompress(data))["records"]
+
+
+def _in_range(record: Dict[str, Any], since: Optional[datetime], until: Optional[datetime]) -> bool:
+    taken_at = record["taken_at"]
+    return (since is None or taken_at >= since) and (until is None or taken_at < until)
+
+
+class SegmentArchive(abc.ABC):
+    """Stores one compressed segment per (user, month)."""
+
+    async def setup(self):
+        pass
+
+    @abc.abstractmethod
+    async def months(self, user_id: str, since: Optional[datetime], until: Optional[datetime]) -> List[datetime]:
+        """Archived months overlapping ``[since, until)``, newest first."""
+
+    @abc.abstractmethod
+    async def read(self, user_id: str, month: datetime) -> List[Dict[str, Any]]:
+        pass
+
+    @abc.abstractmethod
+    async def write(self, user_id: str, month: datetime, records: List[Dict[str, Any]]):
+        pass
+
+    async def merge(self, user_id: str, month: datetime, records: List[Dict[str, Any]]) -> int:
+        """Add records to a segment, replacing any with the same ``id``.
+
+        Read-modify-write: callers hold the archiver lease so no other
+        worker merges into the same segment meanwhile.
+        """
+        merged = {record["id"]: record for record in await self.read(user_id, month)}
+        merged.update((record["id"], record) for record in records)
+        ordered = sorted(merged.values(), key=lambda record: record["taken_at"], reverse=True)
+        await self.write(user_id, month, ordered)
+        return len(ordered)
+
+    @staticmethod
+    def _overlaps(month: datetime, since: Optional[datetime], until: Optional[datetime]) -> bool:
+        return (since is None or next_month(month) > since) and (until is None or month < until)
+
+
+class MongoSegmentArchive(SegmentArchive):
+    collection_name = "health_record_archive"
+
+    def __init__(self, database):
+        self.collection = database[self.collection_name]
+
+    async def setup(self):
+        await self.collection.create_index([("user_id", ASCENDING), ("month", DESCENDING)])
+
+    @staticmethod
+    def _segment_id(user_id: str, month: datetime) -> str:
+        return f"{user_id}:{month:%Y-%m}"
+
+    @staticmethod
+    def _months_query(user_id: str, since: Optional[datetime], until: Optional[datetime]) -> Dict[str, Any]:
+        query: Dict[str, Any] = {"user_id": user_id}
+        month = {}
+        if since is not None:
+            month["$gte"] = month_start(since)
+        if until is not None:
+            month["$lt"] = until
+        if month:
+            query["month"] = month
+        return query
+
+    async def months(self, user_id, since, until):
+        cursor = self.collection.find(self._months_query(user_id, since, until), {"_id": 0, "month": 1})
+        return [segment["month"] async for segment in cursor.sort("month", DESCENDING)]
+
+    async def read(self, user_id, month):
+        segment = await self.collection.find_one({"_id": self._segment_id(user_id, month)}, {"data": 1})
+        return decode_segment(segment["data"]) if segment else []
+
+    async def write(self, user_id, month, records):
+        await self.collection.replace_one(
+            {"_id": self._segment_id(user_id, month)},
+            {
+                "user_id": user_id,
+                "month": month,
+                "count": len(records),
+                "data": bson.Binary(encode_segment(records)),
+                "archived_at": datetime.utcnow(),
+            },
+            upsert=True,
+        )
+
+
+class FileSegmentArchive(SegmentArchive):
+    """Segments as ``<root>/<user_id>/<YYYY-MM>.bson.z`` files."""
+
+    def __init__(self, root: Path):
+        self.root = Path(root)
+
+    def _path(self, user_id: str, month: datetime) -> Path:
+        return self.root / user_id / f"{month:%Y-%m}.bson.z"
+
+    async def setup(self):
+        await asyncio.to_thread(self.root.mkdir, parents=True, exist_ok=True)
+
+    async def months(self, user_id, since, until):
+        def scan():
+            directory = self.root / user_id
+            if not directory.is_dir():
+                return []
+            found = [datetime.strptime(path.name[:7], "%Y-%m") for path in directory.glob("*.bson.z")]
+            return sorted((m for m in found if self._overlaps(m, since, until)), reverse=True)
+        return await asyncio.to_thread(scan)
+
+    async def read(self, user_id, month):
+        path = self._path(user_id, month)
+
+        def load():
+            return decode_segment(path.read_bytes()) if path.exists() else []
+        return await asyncio.to_thread(load)
+
+    async def write(self, user_id, month, records):
+        path = self._path(user_id, month)
+        data = encode_segment(records)
+
+        def save():
+            path.parent.mkdir(parents=True, exist_ok=True)
+            partial = path.with_suffix(".tmp")
+            partial.write_bytes(data)
+            os.replace(partial, path)
+        await asyncio.to_thread(save)
+
+
+def make_archive(database, backend: str = "mongo", path: Optional[str] = None) -> SegmentArchive:
+    if backend == "mongo":
+        return MongoSegmentArchive(database)
+    if backend == "files":
+        return FileSegmentArchive(Path(path or "health_archive"))
+    raise ValueError(f"Unknown archive backend {backend!r}, expected one of {ARCHIVE_BACKENDS}")
+
+
+class HealthHistory:
+    """Live records plus archived segments behind one read API."""
+
+    def __init__(self, store: HealthRecordStore, archive: Optional[SegmentArchive] = None,
+                 horizon_days: Optional[int] = None, lease_seconds: float = 600.0):
+        self.store = store
+        self.archive = archive if horizon_days else None
+        self.horizon_days = horizon_days
+        self.lease_seconds = lease_seconds
+        self.runs = store.database.archive_runs
+
+    @property
+    def horizon(self) -> Optional[datetime]:
+        if not self.archive:
+            return None
+        return datetime.utcnow() - timedelta(days=self.horizon_days)
+
+    def _reaches_archive(self, since: Optional[datetime]) -> bool:
+        horizon = self.horizon
+        return horizon is not None and (since is None or since < horizon)
+
+    async def insert(self, record: Dict[str, Any]):
+        await self.store.insert(record)
+
+    async def iter(self, user_id: str, since=None, until=None, limit: Optional[int] = None) -> AsyncIterator[Dict[str, Any]]:
+        """Yield records newest first, opening archived months only if needed."""
+        emitted = 0
+        seen_old = set()
+        horizon = self.horizon
+        async for record in self.store.iter(user_id, since, until, limit):
+            if horizon is not None and record["taken_at"] < horizon:
+                seen_old.add(record["id"])
+            yield record
+            emitted += 1
+        if (limit and emitted >= limit) or not self._reaches_archive(since):
+            return
+
+        for month in await self.archive.months(user_id, since, until):
+            for record in await self.archive.read(user_id, month):
+                if record["id"] in seen_old or not _in_range(record, since, until):
+                    continue
+                record["user_id"] = user_id
+                yield record
+                emitted += 1
+                if limit and emitted >= limit:
+                    return
+
+    async def find(self, user_id: str, since=None, until=None, limit: Optional[int] = 1000) -> List[Dict[str, Any]]:
+        return [record async for record in self.iter(user_id, since, until, limit)]
+
+    async def status_counts(self, user_id: str, since=None, until=None) -> Dict[str, int]:
+        counts = await self.store.status_counts(user_id, since, until)
+        if self._reaches_archive(since):
+            for month in await self.archive.months(user_id, since, until):
+                for record in await self.archive.read(user_id, month):
+                    if _in_range(record, since, until):
+                        counts[record["status"]] = counts.get(record["status"], 0) + 1
+        return counts
+
+    async def archive_user(self, user_id: str, cutoff: datetime) -> int:
+        """Move one user's records older than ``cutoff`` into monthly segments."""
+        by_month: Dict[datetime, List[Dict[str, Any]]] = {}
+        async for record in self.store.iter(user_id, until=cutoff):
+            record.pop("user_id", None)
+            by_month.setdefault(month_start(record["taken_at"]), []).append(record)
+
+        moved = 0
+        for month, records in by_month.items():
+            # Write the segment before deleting, so a crash leaves at worst a
+            # duplicate that reads skip, never a lost dose.
+            await self.archive.merge(user_id, month, records)
+            await self.store.delete(user_id, [record["id"] for record in records], month, next_month(month))
+            moved += len(records)
+        return moved
+
+    async def _claim(self, owner: str) -> bool:
+        """Take the archiver lease; False if another worker holds it."""
+        now = datetime.utcnow()
+        try:
+            await self.runs.find_one_and_update(
+                {"_id": RUN_ID, "$or": [{"running_until": None}, {"running_until": {"$lt": now}}]},
+                {"$set": {"running_until": now + timedelta(seconds=self.lease_seconds), "owner": owner}},
+                upsert=True,
+                return_document=ReturnDocument.BEFORE,
+            )
+        except DuplicateKeyError:
+            return False
+        return True
+
+    async def _renew(self, owner: str) -> bool:
+        """Extend the lease; False if it expired and another worker took it."""
+        result = await self.runs.update_one(
+            {"_id": RUN_ID, "owner": owner},
+            {"$set": {"running_until": datetime.utcnow() + timedelta(seconds=self.lease_seconds)}},
+        )
+        return result.matched_count == 1
+
+    async def archive_old_records(self) -> int:
+        """Archive every user's old records; returns 0 if another worker holds the lease."""
+        cutoff = self.horizon
+        if cutoff is None:
+            return 0
+        owner = uuid.uuid4().hex
+        if not await self._claim(owner):
+            return 0
+        moved = 0
+        try:
+            for user_id in await self.store.users_with_records_before(cutoff):
+                if not await self._renew(owner):
+                    logger.warning("Archiver lease lost after moving %d records", moved)
+                    break
+                moved += await self.archive_user(user_id, cutoff)
+        finally:
+            await self.runs.update_one({"_id": RUN_ID, "owner": owner}, {"$unset": {"running_until": ""}})
+        return moved
+
+    async def run_archiver(self, interval_seconds: float):
+        """Background loop started by the app lifespan."""
+        while True:
+            try:
+                moved = await self.archive_old_records()
+                if moved:
+                    logger.info("Archived %d health records older than %d days", moved, self.horizon_days)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Health record archival failed")
+            await asyncio.sleep(interval_seconds)
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""Compare health_records storage layouts on scan speed and storage size.
+
+Fills a scratch database (``<DB_NAME>_bench``) with the same synthetic
+dose history in every layout, then times history and 30-day range scans
+and reports collStats sizes:
+
+    python bench_health_records.py --users 200 --days 365 --doses-per-day 3
+"""
+
+import argparse
+import asyncio
+import random
+import time
+import uuid
+from datetime import datetime, timedelta
+
+from record_store import STORAGE_MODES, make_record_store
+from server import Settings, connect
+
+
+def synthetic_records(users: int, days: int, doses_per_day: int, seed: int = 7):
+    rng = random.Random(seed)
+    start = datetime.utcnow() - timedelta(days=days)
+    user_ids = [str(uuid.UUID(int=rng.getrandbits(128))) for _ in range(users)]
+    for user_id in user_ids:
+        medicine_ids = [str(uuid.UUID(int=rng.getrandbits(128))) for _ in range(doses_per_day)]
+        for day in range(days):
+            for dose, medicine_id in enumerate(medicine_ids):
+                taken_at = start + timedelta(days=day, hours=8 + dose * 6, minutes=rng.randrange(60))
+                yield {
+                    "id": str(uuid.UUID(int=rng.getrandbits(128))),
+                    "user_id": user_id,
+                    "medicine_id": medicine_id,
+                    "taken_at": taken_at,
+                    "status": rng.choices(("taken", "missed", "delayed"), (85, 10, 5))[0],
+                    "notes": None,
+                    "created_at": taken_at,
+                }
+
+
+async def timed(samples, func):
+    started = time.perf_counter()
+    for user_id in samples:
+        await func(user_id)
+    return (time.perf_counter() - started) / len(samples) * 1000
+
+
+async def bench(args):
+    settings = Settings.from_env()
+    client = connect(settings)
+    database = client[f"{settings.db_name}_bench"]
+    await client.drop_database(database.name)
+
+    records = list(synthetic_records(args.users, args.days, args.doses_per_day))
+    user_ids = sorted({record["user_id"] for record in records})
+    samples = random.Random(1).choices(user_ids, k=args.samples)
+    since = datetime.utcnow() - timedelta(days=30)
+    print(f"{len(records)} records, {len(user_ids)} users, {args.samples} sampled queries per scan\n")
+    print(f"{'layout':<12}{'load s':>9}{'docs':>10}{'storage KB':>12}{'index KB':>10}"
+          f"{'history ms':>12}{'30d ms':>9}{'counts ms':>11}")
+
+    for mode in args.modes:
+        store = make_record_store(database, mode)
+        await store.setup()
+        started = time.perf_counter()
+        for pos in range(0, len(records), 5000):
+            await store.insert_many(records[pos:pos + 5000])
+        load_seconds = time.perf_counter() - started
+
+        history = await timed(samples, lambda user_id: store.find(user_id, limit=1000))
+        recent = await timed(samples, lambda user_id: store.find(user_id, since=since, limit=None))
+        counts = await timed(samples, lambda user_id: store.status_counts(user_id, since=since))
+        stats = await store.storage_stats()
+        print(f"{mode:<12}{load_seconds:>9.1f}{stats['count'] or 0:>10}"
+              f"{(stats['storage_size'] or 0) / 1024:>12.0f}{(stats['total_index_size'] or 0) / 1024:>10.0f}"
+              f"{history:>12.2f}{recent:>9.2f}{counts:>11.2f}")
+
+    if not args.keep:
+        await client.drop_database(database.name)
+    client.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--days", type=int, default=365)
+    parser.add_argument("--doses-per-day", type=int, default=3)
+    parser.add_argument("--samples", type=int, default=200)
+    parser.add_argument("--modes", nargs="+", choices=STORAGE_MODES, default=list(STORAGE_MODES))
+    parser.add_argument("--keep", action="store_true", help="keep the scratch database")
+    asyncio.run(bench(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+"""Compare buffered and streaming JSON list responses.
+
+Seeds one user with dose history and medicines in a scratch database
+(``<DB_NAME>_bench``), then serves the app with uvicorn and fetches the
+list endpoints with and without ``?stream=true``. Each mode runs in its
+own process so peak RSS is measured separately:
+
+    python bench_list_responses.py --records 10000 --requests 20
+
+Reports time to first byte, total latency and how far the server's peak
+RSS rose above its idle level. Requests are made from a separate thread,
+so reading the response does not compete with the server's event loop.
+
+Without a MongoDB server, --in-memory runs against mongomock_motor
+instead (pip install mongomock-motor). Each process then seeds its own
+data. Mongo time is not representative there, but the serialisation
+cost, time to first byte and memory of the two modes still compare.
+"""
+
+import argparse
+import asyncio
+import json
+import resource
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import uuid
+
+import httpx
+import uvicorn
+
+import server
+from bench_health_records import synthetic_records
+from record_store import make_record_store
+from server import Settings, connect, create_access_token, create_app, hash_password
+
+ENDPOINTS = {
+    "health-records": "/api/health-records?limit={records}",
+    "medicines": "/api/medicines",
+}
+BENCH_EMAIL = "bench@example.com"
+
+
+def peak_rss_kb() -> int:
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS.
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak // 1024 if sys.platform == "darwin" else peak
+
+
+async def seed(settings: Settings, database_name: str, records: int, medicines: int):
+    client = connect(settings)
+    await client.drop_database(database_name)
+    database = client[database_name]
+    user_id = str(uuid.uuid4())
+    await database.users.insert_one({
+        "id": user_id,
+        "email": BENCH_EMAIL,
+        "full_name": "Benchmark User",
+        "family_members": [],
+        "role": "user",
+        "password_hash": hash_password("password"),
+    })
+    store = make_record_store(database, settings.health_records_storage)
+    await store.setup()
+    days = max(records // 3, 1)
+    batch = []
+    for record in synthetic_records(1, days, 3):
+        batch.append(dict(record, user_id=user_id))
+        if len(batch) >= 5000:
+            await store.insert_many(batch)
+            batch = []
+    await store.insert_many(batch)
+    await database.medicines.insert_many([
+        {"id": str(uuid.uuid4()), "user_id": user_id, "name": f"Medicine {n}", "dosage": "10mg",
+         "frequency": "daily", "instructions": "Take with water. " * 20, "stock_quantity": n}
+        for n in range(medicines)
+    ])
+    client.close()
+    return user_id
+
+
+def use_in_memory_mongo():
+    """Point the server and the seeding code at one mongomock_motor client."""
+    global connect
+    from mongomock_motor import AsyncMongoMockClient
+
+    client = AsyncMongoMockClient()
+    client.close = lambda: None
+
+    async def no_warm_up(*args):
+        pass
+
+    server.connect = connect = lambda settings: client
+    server.warm_up_pool = no_warm_up
+
+
+def load_settings(args) -> Settings:
+    if args.in_memory:
+        return Settings(mongo_url="mongodb://in-memory", db_name="healthhub")
+    return Settings.from_env()
+
+
+def fetch(client: httpx.Client, url: str, headers):
+    started = time.perf_counter()
+    first_byte = None
+    size = 0
+    with client.stream("GET", url, headers=headers) as response:
+        response.raise_for_status()
+        for chunk in response.iter_raw():
+            if first_byte is None:
+                first_byte = time.perf_counter() - started
+            size += len(chunk)
+    return first_byte, time.perf_counter() - started, size
+
+
+def fetch_all(url: str, headers, requests: int):
+    with httpx.Client(timeout=120) as client:
+        return [fetch(client, url, headers) for _ in range(requests)]
+
+
+async def run_mode(args):
+    """Child process: serve the app and request one endpoint in one mode."""
+    if args.in_memory:
+        use_in_memory_mongo()
+        await seed(load_settings(args), args.database, args.records, args.medicines)
+    settings = load_settings(args).model_copy(update={"db_name": args.database, "report_interval_seconds": 0})
+    app = create_app(settings)
+    sock = socket.socket()
+    sock.bind(("127.0.0.1", 0))
+    port = sock.getsockname()[1]
+    uvicorn_server = uvicorn.Server(uvicorn.Config(app, log_level="warning"))
+    serving = asyncio.create_task(uvicorn_server.serve(sockets=[sock]))
+    while not uvicorn_server.started:
+        await asyncio.sleep(0.01)
+
+    user = await server.db.users.find_one({"email": BENCH_EMAIL})
+    headers = {"Authorization": f"Bearer {create_access_token(user['id'], BENCH_EMAIL)}"}
+    url = f"http://127.0.0.1:{port}" + ENDPOINTS[args.endpoint].format(records=args.records)
+    if args.mode == "streaming":
+        url += ("&" if "?" in url else "?") + "stream=true"
+
+    idle_rss = peak_rss_kb()
+    results = await asyncio.to_thread(fetch_all, url, headers, args.requests)
+
+    uvicorn_server.should_exit = True
+    await serving
+    print(json.dumps({
+        "ttfb_ms": statistics.median(result[0] for result in results) * 1000,
+        "total_ms": statistics.median(result[1] for result in results) * 1000,
+        "bytes": results[0][2],
+        "rss_growth_kb": peak_rss_kb() - idle_rss,
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--records", type=int, default=10000, help="dose records to seed and request (at most 10000)")
+    parser.add_argument("--medicines", type=int, default=1000)
+    parser.add_argument("--requests", type=int, default=20)
+    parser.add_argument("--endpoints", nargs="+", choices=list(ENDPOINTS), default=list(ENDPOINTS))
+    parser.add_argument("--keep", action="store_true", help="keep the scratch database")
+    parser.add_argument("--in-memory", action="store_true", help="use mongomock_motor instead of MONGO_URL")
+    parser.add_argument("--mode", choices=("buffered", "streaming"), help=argparse.SUPPRESS)
+    parser.add_argument("--endpoint", choices=list(ENDPOINTS), help=argparse.SUPPRESS)
+    parser.add_argument("--database", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.mode:
+        asyncio.run(run_mode(args))
+        return
+
+    settings = load_settings(args)
+    database = f"{settings.db_name}_bench"
+    if not args.in_memory:
+        asyncio.run(seed(settings, database, args.records, args.medicines))
+    print(f"{args.records} dose records and {args.medicines} medicines, median of {args.requests} requests\n")
+    print(f"{'endpoint':<16}{'mode':<11}{'KB':>9}{'TTFB ms':>10}{'total ms':>10}{'RSS growth KB':>15}")
+    for endpoint in args.endpoints:
+        for mode in ("buffered", "streaming"):
+            output = subprocess.run(
+                [sys.executable, __file__, "--mode", mode, "--endpoint", endpoint, "--database", database,
+                 "--records", str(args.records), "--medicines", str(args.medicines), "--requests", str(args.requests)]
+                + (["--in-memory"] if args.in_memory else []),
+                check=True, capture_output=True, text=True,
+            ).stdout
+            result = json.loads(output.strip().splitlines()[-1])
+            print(f"{endpoint:<16}{mode:<11}{result['bytes'] / 1024:>9.0f}{result['ttfb_ms']:>10.1f}"
+                  f"{result['total_ms']:>10.1f}{result['rss_growth_kb']:>15}")
+
+    if not args.keep and not args.in_memory:
+        async def drop():
+            client = connect(settings)
+            await client.drop_database(database)
+            client.close()
+        asyncio.run(drop())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""Short-lived result cache with single-flight loading for per-user reads.
+
+Entries are keyed by ``(name, user_id, version)``. Every write for a user
+bumps that user's version, so later reads miss without scanning the cache,
+and a load that was already running when the write happened is not stored.
+Concurrent identical misses share one loader task. A user's version is
+only kept while some cached or in-flight key refers to it.
+"""
+
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Tuple
+
+CacheKey = Tuple[str, str, int]
+
+
+class ResultCache:
+    def __init__(self, ttl_seconds: float = 5.0, max_entries: int = 10000):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[CacheKey, Tuple[float, Any]]" = OrderedDict()
+        self._inflight: Dict[CacheKey, asyncio.Future] = {}
+        self._versions: Dict[str, int] = {}
+        # Cached and in-flight keys per user; a user's version is dropped
+        # with its last key, so a write with nothing to invalidate is free.
+        self._keys: Dict[str, int] = {}
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.invalidations = 0
+
+    def invalidate(self, *user_ids: str):
+        for user_id in user_ids:
+            if user_id in self._keys:
+                self._versions[user_id] = self._versions.get(user_id, 0) + 1
+        self.invalidations += len(user_ids)
+
+    async def get_or_load(self, name: str, user_id: str, loader: Callable[[], Awaitable[Any]]) -> Any:
+        """Return a cached result, join an in-flight load, or start one.
+
+        The loader runs as its own task, so a caller that disconnects does
+        not cancel the load for the others waiting on it.
+        """
+        key = (name, user_id, self._versions.get(user_id, 0))
+        entry = self._entries.get(key)
+        if entry is not None:
+            if entry[0] > time.monotonic():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            del self._entries[key]
+            self._release(key[1])
+
+        task = self._inflight.get(key)
+        if task is None:
+            self.misses += 1
+            task = asyncio.ensure_future(loader())
+            self._inflight[key] = task
+            self._hold(user_id)
+            task.add_done_callback(lambda done: self._settle(key, done))
+        else:
+            self.coalesced += 1
+        return await asyncio.shield(task)
+
+    def _hold(self, user_id: str):
+        self._keys[user_id] = self._keys.get(user_id, 0) + 1
+
+    def _release(self, user_id: str):
+        if self._keys[user_id] > 1:
+            self._keys[user_id] -= 1
+        else:
+            del self._keys[user_id]
+            self._versions.pop(user_id, None)
+
+    def _settle(self, key: CacheKey, task: asyncio.Future):
+        del self._inflight[key]
+        if (
+            not task.cancelled()
+            and task.exception() is None
+            and self.ttl_seconds > 0
+            and self._versions.get(key[1], 0) == key[2]
+        ):
+            if key not in self._entries:
+                self._hold(key[1])
+            self._entries[key] = (time.monotonic() + self.ttl_seconds, task.result())
+            while len(self._entries) > self.max_entries:
+                evicted, _ = self._entries.popitem(last=False)
+                self._release(evicted[1])
+        self._release(key[1])
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses + self.coalesced
+        return {
+            "entries": len(self._entries),
+            "in_flight": len(self._inflight),
+            "versions": len(self._versions),
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "invalidations": self.invalidations,
+            "hit_ratio": round((self.hits + self.coalesced) / lookups, 3) if lookups else 0.0,
+        }
@@ -0,0 +1,84 @@
+"""Compact on-disk encoding for health records.
+
+The API keeps serving the ``HealthRecord`` JSON shape; only the stored
+document changes:
+
+- the record ``id`` becomes ``_id`` as a 16-byte binary UUID, so there is
+  no second identifier and no ObjectId;
+- ``user_id`` and ``medicine_id`` are binary UUIDs too. Ids that are not
+  in canonical UUID form (lower-case, hyphenated) are kept as strings, so
+  every id reads back exactly as it was written;
+- field names are one letter and ``status`` is a small integer code;
+- ``notes`` is omitted when it is ``None`` and ``created_at`` when it
+  equals ``taken_at``.
+"""
+
+import uuid
+from datetime import datetime
+from typing import Any, Dict, Optional
+
+from bson.binary import Binary, UuidRepresentation
+
+STATUS_CODES = {"taken": 1, "missed": 2, "delayed": 3}
+STATUS_NAMES = {code: name for name, code in STATUS_CODES.items()}
+
+
+def encode_id(value: Optional[str]) -> Any:
+    if value is None:
+        return None
+    try:
+        parsed = uuid.UUID(value)
+    except ValueError:
+        return value
+    if str(parsed) != value:
+        return value
+    return Binary.from_uuid(parsed, UuidRepresentation.STANDARD)
+
+
+def decode_id(value: Any) -> Optional[str]:
+    if isinstance(value, Binary):
+        return str(value.as_uuid(UuidRepresentation.STANDARD))
+    if isinstance(value, uuid.UUID):
+        return str(value)
+    return value
+
+
+def encode_status(status: str) -> Any:
+    return STATUS_CODES.get(status, status)
+
+
+def decode_status(value: Any) -> str:
+    return STATUS_NAMES.get(value, value)
+
+
+def _millis(moment: datetime) -> datetime:
+    # Mongo stores datetimes with millisecond precision.
+    return moment.replace(microsecond=moment.microsecond // 1000 * 1000)
+
+
+def encode_record(record: Dict[str, Any]) -> Dict[str, Any]:
+    document = {
+        "_id": encode_id(record["id"]),
+        "u": encode_id(record["user_id"]),
+        "m": encode_id(record["medicine_id"]),
+        "t": record["taken_at"],
+        "s": encode_status(record["status"]),
+    }
+    if record.get("notes") is not None:
+        document["n"] = record["notes"]
+    created_at = record.get("created_at")
+    if created_at is not None and _millis(created_at) != _millis(record["taken_at"]):
+        document["c"] = created_at
+    return document
+
+
+def decode_record(document: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "id": decode_id(document["_id"]),
+        "user_id": decode_id(document["u"]),
+        "medicine_id": decode_id(document["m"]),
+        "taken_at": document["t"],
+        "status": decode_status(document["s"]),
+        "notes": document.get("n"),
+        "created_at": document.get("c", document["t"]),
+    }
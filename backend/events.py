@@ -0,0 +1,209 @@
+"""Change events pushed to connected users and their family members.
+
+Routes publish events to an ``EventHub``; the hub hands them to a broker,
+and the broker delivers every event back to each hub attached to it. With
+the default ``LocalBroker`` that is just the hub in this process. The
+``MongoBroker`` tails a capped collection instead, so hubs in several
+worker processes see each other's events without extra infrastructure.
+
+Each connection gets a bounded buffer. A slow client loses its oldest
+events rather than growing memory, and is told how many it missed so it
+can refetch.
+"""
+
+import asyncio
+import itertools
+import logging
+from datetime import datetime
+from typing import Any, Dict, Iterable, Optional, Set
+
+from pymongo import CursorType
+from pymongo.errors import CollectionInvalid
+
+logger = logging.getLogger(__name__)
+
+EVENT_BROKERS = ("local", "mongo")
+
+
+class Subscription:
+    def __init__(self, user_id: str, buffer_size: int):
+        self.user_id = user_id
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=buffer_size)
+        self.dropped = 0
+        self.closed = False
+
+    def offer(self, event: Optional[Dict[str, Any]]):
+        if self.queue.full():
+            self.queue.get_nowait()
+            self.dropped += 1
+        self.queue.put_nowait(event)
+
+    async def get(self, timeout: float) -> Optional[Dict[str, Any]]:
+        """Next event, or ``None`` on timeout or when the hub shuts down."""
+        try:
+            event = await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+        if event is None:
+            self.closed = True
+        return event
+
+    def take_dropped(self) -> int:
+        dropped, self.dropped = self.dropped, 0
+        return dropped
+
+
+class LocalBroker:
+    """Delivers events to the hubs attached in this process."""
+
+    def __init__(self):
+        self.hubs: Set["EventHub"] = set()
+
+    def attach(self, hub: "EventHub"):
+        self.hubs.add(hub)
+
+    def detach(self, hub: "EventHub"):
+        self.hubs.discard(hub)
+
+    async def start(self):
+        pass
+
+    async def stop(self):
+        pass
+
+    async def publish(self, event: Dict[str, Any]):
+        for hub in list(self.hubs):
+            hub.deliver(event)
+
+
+class MongoBroker(LocalBroker):
+    """Shares events between worker processes through a capped collection."""
+
+    def __init__(self, database, collection_name: str = "events", size_bytes: int = 16 * 1024 * 1024):
+        super().__init__()
+        self.database = database
+        self.collection_name = collection_name
+        self.size_bytes = size_bytes
+        self._tailer: Optional[asyncio.Task] = None
+
+    async def start(self):
+        try:
+            await self.database.create_collection(self.collection_name, capped=True, size=self.size_bytes)
+        except CollectionInvalid:
+            pass
+        collection = self.database[self.collection_name]
+        # A tailable cursor on an empty capped collection dies immediately.
+        latest = await collection.find_one({}, sort=[("$natural", -1)])
+        if latest is None:
+            await collection.insert_one({"type": "broker.started", "recipients": []})
+            latest = await collection.find_one({}, sort=[("$natural", -1)])
+        self._tailer = asyncio.create_task(self._tail(latest["_id"]))
+
+    async def stop(self):
+        if self._tailer:
+            self._tailer.cancel()
+            try:
+                await self._tailer
+            except asyncio.CancelledError:
+                pass
+            self._tailer = None
+
+    async def publish(self, event: Dict[str, Any]):
+        await self.database[self.collection_name].insert_one(dict(event))
+
+    async def _tail(self, last_id):
+        """Deliver events in insertion order, starting after ``last_id``.
+
+        ObjectIds are made by each publishing process, so they do not sort in
+        insertion order across workers; ``last_id`` is only ever compared for
+        equality. One cursor is kept open for as long as it lives. A new one
+        reads the collection from its start and skips up to ``last_id``, or
+        delivers everything if that event has already been overwritten.
+        """
+        collection = self.database[self.collection_name]
+        while True:
+            cursor = None
+            try:
+                skipping = await collection.find_one({"_id": last_id}, {"_id": 1}) is not None
+                if not skipping:
+                    logger.warning("Event broker fell behind the capped collection; some events were lost")
+                cursor = collection.find({}, cursor_type=CursorType.TAILABLE_AWAIT)
+                # ``async for`` ends on every empty await batch; the cursor
+                # stays usable until the server kills it.
+                while cursor.alive:
+                    async for document in cursor:
+                        document_id = document.pop("_id")
+                        if skipping:
+                            skipping = document_id != last_id
+                            continue
+                        last_id = document_id
+                        await super().publish(document)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Event broker tail failed, retrying")
+            finally:
+                if cursor is not None:
+                    await cursor.close()
+            await asyncio.sleep(0.5)
+
+
+class EventHub:
+    def __init__(self, broker: Optional[LocalBroker] = None, buffer_size: int = 100):
+        self.broker = broker or LocalBroker()
+        self.broker.attach(self)
+        self.buffer_size = buffer_size
+        self._subscriptions: Dict[str, Set[Subscription]] = {}
+        self._sequence = itertools.count(1)
+
+    @property
+    def connections(self) -> int:
+        return sum(len(subscriptions) for subscriptions in self._subscriptions.values())
+
+    def subscribe(self, user_id: str) -> Subscription:
+        subscription = Subscription(user_id, self.buffer_size)
+        self._subscriptions.setdefault(user_id, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        subscriptions = self._subscriptions.get(subscription.user_id)
+        if subscriptions is not None:
+            subscriptions.discard(subscription)
+            if not subscriptions:
+                del self._subscriptions[subscription.user_id]
+
+    async def publish(self, kind: str, actor_id: str, recipients: Iterable[str], data: Dict[str, Any]):
+        await self.broker.publish({
+            "type": kind,
+            "user_id": actor_id,
+            "recipients": list(dict.fromkeys(recipients)),
+            "data": data,
+            "at": datetime.utcnow(),
+        })
+
+    def deliver(self, event: Dict[str, Any]):
+        """Fan an event out to the local connections of its recipients."""
+        targets = [
+            subscription
+            for recipient in event.get("recipients", ())
+            for subscription in self._subscriptions.get(recipient, ())
+        ]
+        if not targets:
+            return
+        event = dict(event, seq=next(self._sequence))
+        for subscription in targets:
+            subscription.offer(event)
+
+    def close(self):
+        for subscriptions in self._subscriptions.values():
+            for subscription in subscriptions:
+                subscription.offer(None)
+        self.broker.detach(self)
+
+
+def make_event_hub(database, broker: str = "local", buffer_size: int = 100) -> EventHub:
+    if broker == "local":
+        return EventHub(LocalBroker(), buffer_size)
+    if broker == "mongo":
+        return EventHub(MongoBroker(database), buffer_size)
+    raise ValueError(f"Unknown event broker {broker!r}, expected one of {EVENT_BROKERS}")
@@ -0,0 +1,163 @@
+"""Idempotency keys for retried create requests.
+
+A request carrying an ``Idempotency-Key`` header runs once per user,
+route and key; retries get the stored response of the first run instead
+of writing again. Keys live in the ``idempotency_keys`` collection, which
+a TTL index empties after ``ttl_seconds``, behind an in-process LRU of
+recent responses so most retries never reach Mongo. The LRU is bounded
+by total encoded size as well as entry count, and responses larger than
+``cache_max_response_bytes`` (medicines with a prescription image) are
+only replayed from Mongo. Concurrent retries in one process wait for the
+first run; across processes, a key that is still being processed
+elsewhere is reported as a conflict.
+"""
+
+import asyncio
+import hashlib
+import json
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from pymongo.errors import DuplicateKeyError
+
+
+class IdempotencyConflict(Exception):
+    """The key is being processed by another request right now."""
+
+
+class IdempotencyMismatch(Exception):
+    """The key was already used with a different request body."""
+
+
+def fingerprint(payload: Any) -> str:
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+class IdempotencyKeys:
+    def __init__(
+        self,
+        collection,
+        ttl_seconds: int = 24 * 3600,
+        cache_max_entries: int = 10000,
+        lock_seconds: float = 60.0,
+        cache_max_bytes: int = 64 * 1024 * 1024,
+        cache_max_response_bytes: int = 64 * 1024,
+    ):
+        self.collection = collection
+        self.ttl_seconds = ttl_seconds
+        self.cache_max_entries = cache_max_entries
+        self.cache_max_bytes = cache_max_bytes
+        self.cache_max_response_bytes = cache_max_response_bytes
+        # A claim older than this is taken to belong to a crashed request.
+        self.lock_seconds = lock_seconds
+        self._entries: "OrderedDict[str, Tuple[float, str, Any, int]]" = OrderedDict()
+        self._cached_bytes = 0
+        self._inflight: Dict[str, Tuple[str, asyncio.Future]] = {}
+        self.executed = 0
+        self.replayed = 0
+        self.conflicts = 0
+
+    async def setup(self):
+        await self.collection.create_index("created_at", expireAfterSeconds=self.ttl_seconds)
+
+    async def run(self, key: str, request_fingerprint: str, handler: Callable[[], Awaitable[Any]]) -> Tuple[Any, bool]:
+        """Return ``(response, replayed)``; ``handler`` runs only for a new key.
+
+        ``handler`` must return a JSON-compatible response. It runs as its
+        own task, so a caller that disconnects does not abandon the write
+        halfway through for a retry that is already waiting on it.
+        """
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] > time.monotonic():
+            self._entries.move_to_end(key)
+            return self._replay(entry[1], entry[2], request_fingerprint)
+
+        inflight = self._inflight.get(key)
+        if inflight is None:
+            task = asyncio.ensure_future(self._execute(key, request_fingerprint, handler))
+            self._inflight[key] = (request_fingerprint, task)
+            task.add_done_callback(lambda done: self._inflight.pop(key, None))
+            return await asyncio.shield(task)
+        first_fingerprint, task = inflight
+        response, _ = await asyncio.shield(task)
+        return self._replay(first_fingerprint, response, request_fingerprint)
+
+    def _replay(self, stored_fingerprint: str, response: Any, request_fingerprint: str) -> Tuple[Any, bool]:
+        if stored_fingerprint != request_fingerprint:
+            raise IdempotencyMismatch()
+        self.replayed += 1
+        return response, True
+
+    def _remember(self, key: str, request_fingerprint: str, response: Any):
+        size = len(json.dumps(response, default=str))
+        previous = self._entries.pop(key, None)
+        if previous is not None:
+            self._cached_bytes -= previous[3]
+        if size > self.cache_max_response_bytes:
+            return
+        self._entries[key] = (time.monotonic() + self.ttl_seconds, request_fingerprint, response, size)
+        self._cached_bytes += size
+        while len(self._entries) > self.cache_max_entries or self._cached_bytes > self.cache_max_bytes:
+            self._cached_bytes -= self._entries.popitem(last=False)[1][3]
+
+    async def _claim(self, key: str, request_fingerprint: str) -> Optional[Dict[str, Any]]:
+        """Claim the key; returns the stored record instead if it has one."""
+        now = datetime.utcnow()
+        locked_until = now + timedelta(seconds=self.lock_seconds)
+        try:
+            await self.collection.insert_one({
+                "_id": key,
+                "fingerprint": request_fingerprint,
+                "status": "processing",
+                "locked_until": locked_until,
+                "created_at": now,
+            })
+            return None
+        except DuplicateKeyError:
+            pass
+        stored = await self.collection.find_one({"_id": key})
+        if stored is None:
+            # Released by a failed request in the meantime.
+            return await self._claim(key, request_fingerprint)
+        if stored["status"] == "completed":
+            return stored
+        taken_over = await self.collection.find_one_and_update(
+            {"_id": key, "status": "processing", "locked_until": {"$lt": now}},
+            {"$set": {"fingerprint": request_fingerprint, "locked_until": locked_until}},
+        )
+        if taken_over is None:
+            self.conflicts += 1
+            raise IdempotencyConflict()
+        return None
+
+    async def _execute(self, key: str, request_fingerprint: str, handler) -> Tuple[Any, bool]:
+        stored = await self._claim(key, request_fingerprint)
+        if stored is not None:
+            self._remember(key, stored["fingerprint"], stored["response"])
+            return self._replay(stored["fingerprint"], stored["response"], request_fingerprint)
+
+        try:
+            response = await handler()
+        except BaseException:
+            # Nothing was stored, so a retry may run the request again.
+            await self.collection.delete_one({"_id": key, "status": "processing"})
+            raise
+        await self.collection.update_one(
+            {"_id": key},
+            {"$set": {"status": "completed", "response": response}, "$unset": {"locked_until": ""}},
+        )
+        self.executed += 1
+        self._remember(key, request_fingerprint, response)
+        return response, False
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "entries": len(self._entries),
+            "cached_bytes": self._cached_bytes,
+            "in_flight": len(self._inflight),
+            "executed": self.executed,
+            "replayed": self.replayed,
+            "conflicts": self.conflicts,
+        }
@@ -0,0 +1,238 @@
+"""Allergy and drug-interaction checks against a local reference dataset.
+
+The dataset is loaded once into an ``InteractionIndex``: every drug and drug
+class name is interned to a small integer, each drug is expanded to the
+sorted tuple of terms it belongs to, and interacting term pairs are packed
+into a sorted ``array`` of 64-bit keys that is searched with ``bisect``.
+A check is then a handful of tuple intersections and binary searches.
+"""
+
+import json
+import re
+from array import array
+from bisect import bisect_left
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+DEFAULT_DATASET = Path(__file__).parent / "data" / "drug_interactions.json"
+
+RESOLVE_CACHE_SIZE = 50000
+
+SEVERITY_RANK = {"minor": 1, "moderate": 2, "major": 3}
+
+_WORD_RE = re.compile(r"[a-z0-9]+(?:['-][a-z0-9]+)*")
+
+
+def normalize(text: str) -> str:
+    return " ".join(_WORD_RE.findall(text.lower()))
+
+
+def _pair_key(a: int, b: int) -> int:
+    if a > b:
+        a, b = b, a
+    return (a << 32) | b
+
+
+class InteractionIndex:
+    def __init__(self, dataset: Dict):
+        self._term_ids: Dict[str, int] = {}
+        self._term_names: List[str] = []
+        self._aliases: Dict[str, int] = {}
+        self._expansion: Dict[int, Tuple[int, ...]] = {}
+        self._cross: Dict[int, Tuple[Tuple[int, str, str], ...]] = {}
+        self._max_alias_words = 1
+        self._resolved: Dict[str, Optional[int]] = {}
+        self._pair_cache: Dict[int, Optional[Tuple[str, str]]] = {}
+
+        for drug, info in dataset.get("drugs", {}).items():
+            drug_id = self._intern(drug)
+            terms = {drug_id}
+            terms.update(self._intern(cls) for cls in info.get("classes", []))
+            self._expansion[drug_id] = tuple(sorted(terms))
+            for alias in info.get("aliases", []):
+                self._add_alias(alias, drug_id)
+
+        for allergen, aliases in dataset.get("allergens", {}).items():
+            allergen_id = self._intern(allergen)
+            for alias in aliases:
+                self._add_alias(alias, allergen_id)
+
+        cross: Dict[int, List[Tuple[int, str, str]]] = {}
+        for entry in dataset.get("cross_reactivity", []):
+            a, b = self._intern(entry["a"]), self._intern(entry["b"])
+            payload = (entry["severity"], entry.get("description", ""))
+            cross.setdefault(a, []).append((b,) + payload)
+            cross.setdefault(b, []).append((a,) + payload)
+        self._cross = {term: tuple(items) for term, items in cross.items()}
+
+        pairs: Dict[int, Tuple[str, str]] = {}
+        for entry in dataset.get("interactions", []):
+            key = _pair_key(self._intern(entry["a"]), self._intern(entry["b"]))
+            payload = (entry["severity"], entry.get("description", ""))
+            current = pairs.get(key)
+            if current is None or SEVERITY_RANK[payload[0]] > SEVERITY_RANK[current[0]]:
+                pairs[key] = payload
+        ordered = sorted(pairs)
+        self._pair_keys = array("Q", ordered)
+        self._pair_payload: List[Tuple[str, str]] = [pairs[key] for key in ordered]
+
+    @classmethod
+    def load(cls, path: Optional[Path] = None) -> "InteractionIndex":
+        with open(path or DEFAULT_DATASET, encoding="utf-8") as handle:
+            return cls(json.load(handle))
+
+    def _intern(self, name: str) -> int:
+        key = normalize(name)
+        term_id = self._term_ids.get(key)
+        if term_id is None:
+            term_id = len(self._term_names)
+            self._term_ids[key] = term_id
+            self._term_names.append(key)
+            self._add_alias(key, term_id)
+        return term_id
+
+    def _add_alias(self, alias: str, term_id: int):
+        key = normalize(alias)
+        self._aliases[key] = term_id
+        self._max_alias_words = max(self._max_alias_words, key.count(" ") + 1)
+
+    @property
+    def size(self) -> Dict[str, int]:
+        return {
+            "terms": len(self._term_names),
+            "aliases": len(self._aliases),
+            "interactions": len(self._pair_keys),
+        }
+
+    def name_of(self, term_id: int) -> str:
+        return self._term_names[term_id]
+
+    def resolve(self, text: Optional[str]) -> Optional[int]:
+        """Map free text ("Amoxil 500mg capsules") to a known term id.
+
+        Tries the whole string first, then the longest matching run of words.
+        """
+        if not text:
+            return None
+        try:
+            return self._resolved[text]
+        except KeyError:
+            pass
+        if len(self._resolved) >= RESOLVE_CACHE_SIZE:
+            self._resolved.clear()
+        term_id = self._resolved[text] = self._resolve(normalize(text))
+        return term_id
+
+    def _resolve(self, key: str) -> Optional[int]:
+        term_id = self._aliases.get(key)
+        if term_id is not None:
+            return term_id
+        words = key.split(" ")
+        for width in range(min(self._max_alias_words, len(words)), 0, -1):
+            for start in range(len(words) - width + 1):
+                term_id = self._aliases.get(" ".join(words[start:start + width]))
+                if term_id is not None:
+                    return term_id
+        return None
+
+    def terms_of(self, term_id: int) -> Tuple[int, ...]:
+        return self._expansion.get(term_id, (term_id,))
+
+    def _lookup_pair(self, a: int, b: int) -> Optional[Tuple[str, str]]:
+        key = _pair_key(a, b)
+        pos = bisect_left(self._pair_keys, key)
+        if pos < len(self._pair_keys) and self._pair_keys[pos] == key:
+            return self._pair_payload[pos]
+        return None
+
+    def interaction(self, a: int, b: int) -> Optional[Tuple[str, str]]:
+        """Most severe interaction between two resolved drugs, if any."""
+        key = _pair_key(a, b)
+        if key in self._pair_cache:
+            return self._pair_cache[key]
+        best = None
+        for term_a in self.terms_of(a):
+            for term_b in self.terms_of(b):
+                found = self._lookup_pair(term_a, term_b)
+                if found and (best is None or SEVERITY_RANK[found[0]] > SEVERITY_RANK[best[0]]):
+                    best = found
+        self._pair_cache[key] = best
+        return best
+
+    def allergy(self, drug_id: int, allergy_ids: Sequence[int]) -> Optional[Tuple[str, str, str]]:
+        """Return ``(kind, severity, description)`` if the drug hits an allergy."""
+        drug_terms = self.terms_of(drug_id)
+        for allergy_id in allergy_ids:
+            if allergy_id in drug_terms:
+                return ("allergy", "major", f"Listed allergy to {self.name_of(allergy_id)}")
+        for allergy_id in allergy_ids:
+            for allergy_term in self.terms_of(allergy_id):
+                for related, severity, description in self._cross.get(allergy_term, ()):
+                    if related in drug_terms:
+                        return ("cross_reactivity", severity, description)
+        return None
+
+    def resolve_allergies(self, allergies: Optional[Iterable[str]]) -> List[int]:
+        resolved = (self.resolve(allergy) for allergy in allergies or [])
+        return [term_id for term_id in resolved if term_id is not None]
+
+    def check(
+        self,
+        medicine_name: str,
+        allergies: Optional[Iterable[str]] = None,
+        current_medicines: Iterable[Dict] = (),
+        allergy_ids: Optional[List[int]] = None,
+    ) -> List[Dict]:
+        """Check one medicine against a user's allergies and other medicines.
+
+        ``current_medicines`` are medicine documents (only ``id`` and ``name``
+        are read). Returns warning dicts sorted most severe first.
+        """
+        drug_id = self.resolve(medicine_name)
+        if drug_id is None:
+            return []
+        if allergy_ids is None:
+            allergy_ids = self.resolve_allergies(allergies)
+
+        warnings = []
+        hit = self.allergy(drug_id, allergy_ids)
+        if hit:
+            kind, severity, description = hit
+            warnings.append({
+                "type": kind,
+                "severity": severity,
+                "medicine_name": medicine_name,
+                "conflicts_with": None,
+                "conflicts_with_id": None,
+                "description": description,
+            })
+
+        for other in current_medicines:
+            other_id = self.resolve(other.get("name"))
+            if other_id is None:
+                continue
+            found = self.interaction(drug_id, other_id)
+            if found:
+                severity, description = found
+                warnings.append({
+                    "type": "interaction",
+                    "severity": severity,
+                    "medicine_name": medicine_name,
+                    "conflicts_with": other.get("name"),
+                    "conflicts_with_id": other.get("id"),
+                    "description": description,
+                })
+
+        warnings.sort(key=lambda w: -SEVERITY_RANK[w["severity"]])
+        return warnings
+
+    def audit(self, allergies: Optional[Iterable[str]], medicines: Sequence[Dict]) -> List[Dict]:
+        """Check every medicine of one person, reporting each pair once."""
+        allergy_ids = self.resolve_allergies(allergies)
+        warnings = []
+        for pos, medicine in enumerate(medicines):
+            for warning in self.check(medicine.get("name", ""), None, medicines[pos + 1:], allergy_ids):
+                warning["medicine_id"] = medicine.get("id")
+                warnings.append(warning)
+        warnings.sort(key=lambda w: -SEVERITY_RANK[w["severity"]])
+        return warnings
@@ -0,0 +1,189 @@
+"""Background jobs for side effects of write requests.
+
+Jobs are persisted in the ``jobs`` collection before they are queued, so
+a crash or restart never loses one: on startup, and every poll interval,
+due ``pending`` jobs and ``running`` jobs whose lease has expired are
+picked up again. A worker claims a job with a single atomic update, so
+jobs are not run twice even when several processes share the collection.
+Failed jobs are retried with exponential backoff up to ``max_attempts``.
+"""
+
+import asyncio
+import logging
+import time
+import uuid
+from collections import deque
+from datetime import datetime, timedelta
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set
+
+from pymongo import ASCENDING, ReturnDocument
+
+logger = logging.getLogger(__name__)
+
+JobHandler = Callable[[Dict[str, Any]], Awaitable[None]]
+
+
+def due_query(now: datetime) -> Dict[str, Any]:
+    """Jobs to run now: pending ones that are due, and running ones whose lease expired."""
+    return {"$or": [
+        {"status": "pending", "run_at": {"$lte": now}},
+        {"status": "running", "locked_until": {"$lt": now}},
+    ]}
+
+
+class JobQueue:
+    def __init__(
+        self,
+        collection,
+        handlers: Dict[str, JobHandler],
+        workers: int = 4,
+        max_attempts: int = 5,
+        backoff_seconds: float = 1.0,
+        backoff_max_seconds: float = 300.0,
+        lease_seconds: float = 300.0,
+        poll_interval_seconds: float = 1.0,
+    ):
+        self.collection = collection
+        self.handlers = handlers
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.backoff_seconds = backoff_seconds
+        self.backoff_max_seconds = backoff_max_seconds
+        self.lease_seconds = lease_seconds
+        self.poll_interval_seconds = poll_interval_seconds
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self._queued: Set[str] = set()
+        self._tasks: List[asyncio.Task] = []
+        self._latencies: deque = deque(maxlen=1000)
+        self.completed = 0
+        self.failed = 0
+        self.retried = 0
+
+    async def setup(self):
+        await self.collection.create_index([("status", ASCENDING), ("run_at", ASCENDING)])
+        await self.collection.create_index("finished_at", expireAfterSeconds=7 * 24 * 3600)
+
+    async def start(self):
+        self._tasks = [asyncio.create_task(self._work()) for _ in range(self.workers)]
+        self._tasks.append(asyncio.create_task(self._poll()))
+
+    async def stop(self, drain_timeout: float = 10.0):
+        """Let workers finish queued jobs, then stop. Unfinished jobs stay in Mongo."""
+        try:
+            await asyncio.wait_for(self._queue.join(), drain_timeout)
+        except asyncio.TimeoutError:
+            logger.warning("Stopping job queue with %d jobs still queued", self._queue.qsize())
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def enqueue(self, kind: str, payload: Dict[str, Any]) -> str:
+        if kind not in self.handlers:
+            raise ValueError(f"No handler registered for job kind {kind!r}")
+        now = datetime.utcnow()
+        job_id = str(uuid.uuid4())
+        await self.collection.insert_one({
+            "_id": job_id,
+            "kind": kind,
+            "payload": payload,
+            "status": "pending",
+            "attempts": 0,
+            "run_at": now,
+            "created_at": now,
+        })
+        self._push(job_id)
+        return job_id
+
+    def _push(self, job_id: str):
+        if job_id not in self._queued:
+            self._queued.add(job_id)
+            self._queue.put_nowait(job_id)
+
+    async def _poll(self):
+        while True:
+            await asyncio.sleep(self.poll_interval_seconds)
+            try:
+                now = datetime.utcnow()
+                cursor = self.collection.find(due_query(now), {"_id": 1}).limit(100)
+                async for job in cursor:
+                    self._push(job["_id"])
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Polling for jobs failed")
+
+    async def _claim(self, job_id: str) -> Optional[Dict[str, Any]]:
+        now = datetime.utcnow()
+        return await self.collection.find_one_and_update(
+            dict(due_query(now), _id=job_id),
+            {
+                "$set": {"status": "running", "locked_until": now + timedelta(seconds=self.lease_seconds)},
+                "$inc": {"attempts": 1},
+            },
+            return_document=ReturnDocument.AFTER,
+        )
+
+    async def _work(self):
+        while True:
+            job_id = await self._queue.get()
+            try:
+                self._queued.discard(job_id)
+                job = await self._claim(job_id)
+                if job is not None:
+                    await self._run(job)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Job %s could not be processed", job_id)
+            finally:
+                self._queue.task_done()
+
+    async def _run(self, job: Dict[str, Any]):
+        started = time.perf_counter()
+        try:
+            await self.handlers[job["kind"]](job["payload"])
+        except Exception as e:
+            await self._fail(job, e)
+            return
+        finished = datetime.utcnow()
+        await self.collection.update_one(
+            {"_id": job["_id"]},
+            {"$set": {"status": "done", "finished_at": finished}, "$unset": {"locked_until": ""}},
+        )
+        self.completed += 1
+        self._latencies.append((
+            (finished - job["created_at"]).total_seconds(),
+            time.perf_counter() - started,
+        ))
+
+    async def _fail(self, job: Dict[str, Any], error: Exception):
+        update: Dict[str, Any] = {"last_error": repr(error)}
+        if job["attempts"] >= self.max_attempts:
+            update.update(status="failed", finished_at=datetime.utcnow())
+            self.failed += 1
+            logger.error("Job %s (%s) failed permanently: %r", job["_id"], job["kind"], error)
+        else:
+            delay = min(self.backoff_seconds * 2 ** (job["attempts"] - 1), self.backoff_max_seconds)
+            update.update(status="pending", run_at=datetime.utcnow() + timedelta(seconds=delay))
+            self.retried += 1
+            logger.warning("Job %s (%s) failed, retrying in %.1fs: %r", job["_id"], job["kind"], delay, error)
+        await self.collection.update_one({"_id": job["_id"]}, {"$set": update, "$unset": {"locked_until": ""}})
+
+    def stats(self) -> Dict[str, Any]:
+        latencies = sorted(latency for latency, _ in self._latencies)
+        run_times = [run_time for _, run_time in self._latencies]
+
+        def percentile(values, fraction):
+            return round(values[min(int(len(values) * fraction), len(values) - 1)] * 1000, 1) if values else None
+
+        return {
+            "queue_depth": self._queue.qsize(),
+            "workers": self.workers,
+            "completed": self.completed,
+            "retried": self.retried,
+            "failed": self.failed,
+            "latency_ms_p50": percentile(latencies, 0.5),
+            "latency_ms_p95": percentile(latencies, 0.95),
+            "run_time_ms_avg": round(sum(run_times) / len(run_times) * 1000, 1) if run_times else None,
+        }
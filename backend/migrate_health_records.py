@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+"""Copy dose history between health_records storage layouts.
+
+    python migrate_health_records.py --to compact
+    python migrate_health_records.py --to compact --resume
+    python migrate_health_records.py --to compact --report
+    python migrate_health_records.py --from buckets --to collection --force
+
+Reads MONGO_URL/DB_NAME like the server. The copy runs in batches and
+records a checkpoint after each one, so it can run while the server keeps
+writing in the old layout: copy once, run again with --resume to catch up
+on records written since, then set HEALTH_RECORDS_STORAGE to the target
+mode, restart, and --resume a final time. Targets skip records they
+already hold, so overlapping copies are harmless.
+
+Only the collection layout can resume, since its ObjectIds grow with
+insertion time; resuming starts a few minutes before the checkpoint to
+cover clock skew between app servers. Copy from the other layouts in a
+single run with writes stopped. --report compares collStats of the two
+layouts.
+"""
+
+import argparse
+import asyncio
+import time
+from datetime import datetime, timedelta
+
+from bson import ObjectId
+
+from record_store import STORAGE_MODES, make_record_store
+from server import Settings, connect
+
+RESUME_OVERLAP = timedelta(minutes=10)
+
+
+def _kb(value) -> str:
+    return f"{(value or 0) / 1024:,.0f} KB"
+
+
+async def report(source, target):
+    stats = [await source.storage_stats(), await target.storage_stats()]
+    rows = [
+        ("documents", lambda s: f"{s['count'] or 0:,}"),
+        ("avg document", lambda s: f"{s['avg_obj_size'] or 0:,} B"),
+        ("data size", lambda s: _kb(s["size"])),
+        ("storage size", lambda s: _kb(s["storage_size"])),
+        ("index size", lambda s: _kb(s["total_index_size"])),
+        ("working set", lambda s: _kb((s["size"] or 0) + (s["total_index_size"] or 0))),
+    ]
+    print(f"{'':<16}{stats[0]['collection']:>28}{stats[1]['collection']:>28}")
+    for label, value in rows:
+        print(f"{label:<16}{value(stats[0]):>28}{value(stats[1]):>28}")
+    for side in stats:
+        for name, size in side["index_sizes"].items():
+            print(f"  {side['collection']}.{name}: {_kb(size)}")
+
+
+async def migrate(args):
+    settings = Settings.from_env()
+    client = connect(settings)
+    database = client[settings.db_name]
+    source = make_record_store(database, args.source)
+    target = make_record_store(database, args.target)
+    checkpoints = database.migrations
+    checkpoint_id = f"health_records:{args.source}->{args.target}"
+
+    if args.report:
+        await report(source, target)
+        client.close()
+        return
+
+    after = None
+    if args.resume:
+        if not source.growing_ids:
+            raise SystemExit(f"Cannot resume from the {args.source} layout; copy it in one run with writes stopped")
+        checkpoint = await checkpoints.find_one({"_id": checkpoint_id})
+        if checkpoint:
+            after = ObjectId.from_datetime(checkpoint["last_id"].generation_time - RESUME_OVERLAP)
+    else:
+        existing = await target.count()
+        if existing and not args.force:
+            raise SystemExit(
+                f"{target.collection_name} already holds {existing} records; "
+                f"pass --resume to continue or --force to replace them"
+            )
+        if existing:
+            await target.drop()
+        await checkpoints.delete_one({"_id": checkpoint_id})
+    await target.setup()
+
+    started = time.perf_counter()
+    copied = 0
+    async for batch in source.iter_all(args.batch_size, after):
+        await target.insert_many([{k: v for k, v in record.items() if k != "_id"} for record in batch])
+        copied += len(batch)
+        progress = {"updated_at": datetime.utcnow()}
+        if source.growing_ids:
+            progress["last_id"] = batch[-1]["_id"]
+        await checkpoints.update_one(
+            {"_id": checkpoint_id}, {"$set": progress, "$inc": {"copied": len(batch)}}, upsert=True
+        )
+        print(f"  copied {copied} records", end="\r", flush=True)
+        if args.pause_ms:
+            await asyncio.sleep(args.pause_ms / 1000)
+
+    print(f"\nCopied {copied} records from {source.collection_name} to {target.collection_name} "
+          f"in {time.perf_counter() - started:.1f}s")
+    source_count, target_count = await source.count(), await target.count()
+    if source_count != target_count:
+        print(f"Warning: source holds {source_count} records, target {target_count}")
+
+    if args.drop_source:
+        if source_count != target_count:
+            raise SystemExit("Not dropping the source while counts differ")
+        await source.drop()
+        print(f"Dropped {source.collection_name}")
+    client.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--from", dest="source", choices=STORAGE_MODES, default="collection")
+    parser.add_argument("--to", dest="target", choices=STORAGE_MODES, required=True)
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--pause-ms", type=int, default=0, help="sleep between batches to limit load")
+    parser.add_argument("--resume", action="store_true", help="continue after the last checkpoint")
+    parser.add_argument("--force", action="store_true", help="replace records already in the target")
+    parser.add_argument("--drop-source", action="store_true", help="drop the source collection afterwards")
+    parser.add_argument("--report", action="store_true", help="only compare storage of the two layouts")
+    args = parser.parse_args()
+    if args.source == args.target:
+        parser.error("--from and --to must differ")
+    asyncio.run(migrate(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+"""Read preferences and connection pool metrics for the Mongo client.
+
+``read_preference`` turns a setting like ``secondaryPreferred`` plus an
+optional max staleness into a pymongo read preference, for the per-route
+database handles opened in ``server.py``.
+
+``PoolMetrics`` is a pymongo pool listener that records how long each
+operation waited to check a connection out of the pool, per server, and
+how often a checkout failed. Waits that keep growing mean
+``MONGO_MAX_POOL_SIZE`` is too small for the load, or queries hold
+connections too long.
+"""
+
+import threading
+import time
+from collections import deque
+from typing import Any, Dict, Optional
+
+from pymongo import monitoring
+from pymongo.read_preferences import Nearest, Primary, PrimaryPreferred, Secondary, SecondaryPreferred
+
+READ_PREFERENCES = {
+    "primary": Primary,
+    "primaryPreferred": PrimaryPreferred,
+    "secondary": Secondary,
+    "secondaryPreferred": SecondaryPreferred,
+    "nearest": Nearest,
+}
+
+
+def read_preference(name: str, max_staleness_seconds: Optional[int] = None) -> Any:
+    if name not in READ_PREFERENCES:
+        raise ValueError(f"Unknown read preference {name!r}, expected one of {', '.join(READ_PREFERENCES)}")
+    if name == "primary":
+        if max_staleness_seconds is not None:
+            raise ValueError("max staleness cannot be combined with the primary read preference")
+        return Primary()
+    # MongoDB requires at least 90 seconds; -1 means no limit.
+    return READ_PREFERENCES[name](max_staleness=max_staleness_seconds if max_staleness_seconds is not None else -1)
+
+
+class _ServerPool:
+    def __init__(self, samples: int):
+        self.waits: deque = deque(maxlen=samples)
+        self.checkouts = 0
+        self.failures: Dict[str, int] = {}
+        self.open = 0
+        self.in_use = 0
+
+    def stats(self) -> Dict[str, Any]:
+        waits = sorted(self.waits)
+
+        def percentile(fraction):
+            return round(waits[min(int(len(waits) * fraction), len(waits) - 1)] * 1000, 2) if waits else None
+
+        return {
+            "connections": self.open,
+            "in_use": self.in_use,
+            "checkouts": self.checkouts,
+            "checkout_failures": dict(self.failures),
+            "wait_ms_p50": percentile(0.5),
+            "wait_ms_p95": percentile(0.95),
+            "wait_ms_max": round(waits[-1] * 1000, 2) if waits else None,
+        }
+
+
+class PoolMetrics(monitoring.ConnectionPoolListener):
+    """Checkout wait times per server, over the last ``samples`` checkouts."""
+
+    def __init__(self, samples: int = 1000):
+        self.samples = samples
+        self._pools: Dict[str, _ServerPool] = {}
+        self._lock = threading.Lock()
+        # Motor runs each operation on an executor thread, and a checkout
+        # starts and finishes on the same thread.
+        self._local = threading.local()
+
+    def _pool(self, address) -> _ServerPool:
+        key = f"{address[0]}:{address[1]}"
+        pool = self._pools.get(key)
+        if pool is None:
+            pool = self._pools.setdefault(key, _ServerPool(self.samples))
+        return pool
+
+    def connection_check_out_started(self, event):
+        self._local.started = time.perf_counter()
+
+    def connection_checked_out(self, event):
+        started = getattr(self._local, "started", None)
+        self._local.started = None
+        with self._lock:
+            pool = self._pool(event.address)
+            pool.checkouts += 1
+            pool.in_use += 1
+            if started is not None:
+                pool.waits.append(time.perf_counter() - started)
+
+    def connection_check_out_failed(self, event):
+        self._local.started = None
+        with self._lock:
+            failures = self._pool(event.address).failures
+            failures[event.reason] = failures.get(event.reason, 0) + 1
+
+    def connection_checked_in(self, event):
+        with self._lock:
+            self._pool(event.address).in_use -= 1
+
+    def connection_created(self, event):
+        with self._lock:
+            self._pool(event.address).open += 1
+
+    def connection_closed(self, event):
+        with self._lock:
+            self._pool(event.address).open -= 1
+
+    def connection_ready(self, event):
+        pass
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {address: pool.stats() for address, pool in sorted(self._pools.items())}
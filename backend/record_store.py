@@ -0,0 +1,448 @@
+"""Storage backends for dose history (``health_records``).
+
+All backends take and return plain record dicts shaped like the
+``HealthRecord`` model, so routes do not care how doses are laid out:
+
+- ``collection``: one document per dose in ``health_records`` (default).
+- ``timeseries``: a MongoDB time-series collection keyed on ``taken_at``
+  with ``user_id`` as the meta field; the server buckets internally.
+- ``buckets``: one document per user-day in ``health_record_buckets``
+  holding that day's doses in an array.
+- ``compact``: one document per dose in ``health_records_compact`` using
+  the binary-UUID, short-field encoding from ``compact.py``.
+"""
+
+from datetime import datetime
+from typing import Any, AsyncIterator, Dict, Iterable, List, Optional
+
+from pymongo import DESCENDING, ASCENDING, UpdateOne
+from pymongo.errors import BulkWriteError, CollectionInvalid
+
+from compact import STATUS_CODES, decode_id, decode_record, decode_status, encode_id, encode_record
+
+STORAGE_MODES = ("collection", "timeseries", "buckets", "compact")
+
+DUPLICATE_KEY = 11000
+
+
+def _time_range(since: Optional[datetime], until: Optional[datetime]) -> Dict[str, datetime]:
+    query = {}
+    if since is not None:
+        query["$gte"] = since
+    if until is not None:
+        query["$lt"] = until
+    return query
+
+
+class HealthRecordStore:
+    """Plain layout: one document per dose."""
+
+    mode = "collection"
+    collection_name = "health_records"
+    user_field = "user_id"
+    time_field = "taken_at"
+    # ``_id`` is an ObjectId, which leads with its creation time, so
+    # ``iter_all`` can resume after the last id a migration copied.
+    growing_ids = True
+
+    def __init__(self, database):
+        self.database = database
+        self.collection = database[self.collection_name]
+
+    async def setup(self):
+        await self.collection.create_index([("user_id", ASCENDING), ("taken_at", DESCENDING)])
+        # Cross-user time ranges, for the analytics views in reports.py.
+        await self.collection.create_index([("taken_at", DESCENDING)])
+        # Lets insert_many skip records that were already copied.
+        await self.collection.create_index([("id", ASCENDING)], unique=True)
+
+    def _query(self, user_id: str, since: Optional[datetime], until: Optional[datetime]) -> Dict[str, Any]:
+        query: Dict[str, Any] = {"user_id": user_id}
+        taken_at = _time_range(since, until)
+        if taken_at:
+            query["taken_at"] = taken_at
+        return query
+
+    async def insert(self, record: Dict[str, Any]):
+        await self.collection.insert_one(dict(record))
+
+    async def insert_many(self, records: List[Dict[str, Any]]):
+        # Record ids are unique, so re-copying a batch is a no-op.
+        await self._insert_new([dict(record) for record in records])
+
+    async def _insert_new(self, documents: List[Dict[str, Any]]):
+        if not documents:
+            return
+        try:
+            await self.collection.insert_many(documents, ordered=False)
+        except BulkWriteError as e:
+            if any(error["code"] != DUPLICATE_KEY for error in e.details.get("writeErrors", [])):
+                raise
+
+    async def iter(
+        self,
+        user_id: str,
+        since: Optional[datetime] = None,
+        until: Optional[datetime] = None,
+        limit: Optional[int] = None,
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """Yield a user's records newest first."""
+        cursor = self.collection.find(self._query(user_id, since, until), {"_id": 0}).sort("taken_at", DESCENDING)
+        if limit:
+            cursor = cursor.limit(limit)
+        async for record in cursor:
+            yield record
+
+    async def find(self, user_id: str, since=None, until=None, limit: Optional[int] = 1000) -> List[Dict[str, Any]]:
+        return [record async for record in self.iter(user_id, since, until, limit)]
+
+    async def status_counts(self, user_id: str, since=None, until=None) -> Dict[str, int]:
+        pipeline = [
+            {"$match": self._query(user_id, since, until)},
+            {"$group": {"_id": "$status", "count": {"$sum": 1}}},
+        ]
+        return {row["_id"]: row["count"] async for row in self.collection.aggregate(pipeline)}
+
+    def dose_stages(self, since: Optional[datetime], until: Optional[datetime]) -> List[Dict[str, Any]]:
+        """Aggregation stages yielding every user's doses in a time range.
+
+        Each output document is ``{user_id, medicine_id, taken_at, status}``
+        whatever the layout, so report pipelines can be appended to it.
+        """
+        taken_at = _time_range(since, until)
+        return [
+            {"$match": {"taken_at": taken_at} if taken_at else {}},
+            {"$project": {"_id": 0, "user_id": 1, "medicine_id": 1, "taken_at": 1, "status": 1}},
+        ]
+
+    async def iter_all(self, batch_size: int = 1000, after: Any = None) -> AsyncIterator[List[Dict[str, Any]]]:
+        """Yield every record in ``_id`` order and in batches, for migrations.
+
+        Records keep their ``_id`` so a migration can resume after the last
+        one it copied.
+        """
+        query = {"_id": {"$gt": after}} if after is not None else {}
+        batch = []
+        async for record in self.collection.find(query).sort("_id", ASCENDING).batch_size(batch_size):
+            batch.append(record)
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    def _delete_query(self, user_id: str, ids: List[str], since=None, until=None) -> Dict[str, Any]:
+        query = self._query(user_id, since, until)
+        query["id"] = {"$in": ids}
+        return query
+
+    async def delete(self, user_id: str, ids: List[str], since=None, until=None):
+        """Delete records by id; the optional time range lets the index narrow the scan."""
+        await self.collection.delete_many(self._delete_query(user_id, ids, since, until))
+
+    def _archival_query(self, cutoff: datetime) -> Dict[str, Any]:
+        return {self.time_field: {"$lt": cutoff}}
+
+    async def users_with_records_before(self, cutoff: datetime) -> List[str]:
+        # The time index limits this to records due for archival, which the
+        # archiver removes, so it stays small however long history gets.
+        return await self.collection.distinct(self.user_field, self._archival_query(cutoff))
+
+    async def count(self) -> int:
+        return await self.collection.count_documents({})
+
+    async def drop(self):
+        await self.collection.drop()
+
+    async def storage_stats(self) -> Dict[str, Any]:
+        stats = await self.database.command("collStats", self.collection_name)
+        return {
+            "collection": self.collection_name,
+            "count": stats.get("count"),
+            "avg_obj_size": stats.get("avgObjSize"),
+            "size": stats.get("size"),
+            "storage_size": stats.get("storageSize"),
+            "total_index_size": stats.get("totalIndexSize"),
+            "index_sizes": stats.get("indexSizes", {}),
+        }
+
+
+class TimeSeriesRecordStore(HealthRecordStore):
+    """MongoDB time-series collection (requires MongoDB 5.0+, 7.0+ for archival deletes)."""
+
+    mode = "timeseries"
+    collection_name = "health_records_ts"
+    # Time-series collections have no index on ``_id`` to resume along.
+    growing_ids = False
+
+    async def setup(self):
+        try:
+            await self.database.create_collection(
+                self.collection_name,
+                timeseries={"timeField": "taken_at", "metaField": "user_id", "granularity": "hours"},
+            )
+        except CollectionInvalid:
+            pass
+        # MongoDB 6.3+ builds this automatically; older servers need it explicitly.
+        await self.collection.create_index([("user_id", ASCENDING), ("taken_at", DESCENDING)])
+        await self.collection.create_index([("taken_at", DESCENDING)])
+
+    async def insert_many(self, records: List[Dict[str, Any]]):
+        # Time-series collections cannot have unique indexes; look up the
+        # batch's ids within its time range instead.
+        if not records:
+            return
+        times = [record["taken_at"] for record in records]
+        existing = set(await self.collection.distinct("id", {
+            "user_id": {"$in": list({record["user_id"] for record in records})},
+            "taken_at": {"$gte": min(times), "$lte": max(times)},
+            "id": {"$in": [record["id"] for record in records]},
+        }))
+        await super().insert_many([record for record in records if record["id"] not in existing])
+
+
+class BucketedRecordStore(HealthRecordStore):
+    """One document per user-day: ``{_id: "<user>:<YYYY-MM-DD>", doses: [...]}``."""
+
+    mode = "buckets"
+    collection_name = "health_record_buckets"
+    time_field = "day"
+    # Old buckets keep receiving doses, so no id marks how far a copy got.
+    growing_ids = False
+
+    async def setup(self):
+        await self.collection.create_index([("user_id", ASCENDING), ("day", DESCENDING)])
+        await self.collection.create_index([("day", DESCENDING)])
+
+    @staticmethod
+    def _day(taken_at: datetime) -> datetime:
+        return datetime(taken_at.year, taken_at.month, taken_at.day)
+
+    def _bucket_query(self, user_id: str, since: Optional[datetime], until: Optional[datetime]) -> Dict[str, Any]:
+        query: Dict[str, Any] = {"user_id": user_id}
+        day = {}
+        if since is not None:
+            day["$gte"] = self._day(since)
+        if until is not None:
+            day["$lt"] = until
+        if day:
+            query["day"] = day
+        return query
+
+    def _updates(self, records: Iterable[Dict[str, Any]]) -> List[UpdateOne]:
+        buckets: Dict[str, Dict[str, Any]] = {}
+        for record in records:
+            dose = {k: v for k, v in record.items() if k not in ("_id", "user_id")}
+            day = self._day(record["taken_at"])
+            key = f"{record['user_id']}:{day.date().isoformat()}"
+            bucket = buckets.setdefault(key, {"user_id": record["user_id"], "day": day, "doses": []})
+            bucket["doses"].append(dose)
+        return [
+            UpdateOne(
+                {"_id": key},
+                {
+                    "$setOnInsert": {"user_id": bucket["user_id"], "day": bucket["day"]},
+                    "$push": {"doses": {"$each": bucket["doses"]}},
+                    "$inc": {"count": len(bucket["doses"])},
+                },
+                upsert=True,
+            )
+            for key, bucket in buckets.items()
+        ]
+
+    async def insert(self, record: Dict[str, Any]):
+        await self.collection.bulk_write(self._updates([record]))
+
+    async def insert_many(self, records: List[Dict[str, Any]]):
+        # Only append doses whose id the bucket does not hold yet, so
+        # re-copying a batch is a no-op.
+        buckets: Dict[str, Dict[str, Any]] = {}
+        for record in records:
+            day = self._day(record["taken_at"])
+            key = f"{record['user_id']}:{day.date().isoformat()}"
+            bucket = buckets.setdefault(key, {"user_id": record["user_id"], "day": day, "doses": []})
+            bucket["doses"].append({k: v for k, v in record.items() if k not in ("_id", "user_id")})
+        if not buckets:
+            return
+        await self.collection.bulk_write([
+            UpdateOne({"_id": key}, [
+                {"$set": {
+                    "user_id": {"$literal": bucket["user_id"]},
+                    "day": {"$literal": bucket["day"]},
+                    "doses": {"$concatArrays": [
+                        {"$ifNull": ["$doses", []]},
+                        {"$filter": {
+                            "input": {"$literal": bucket["doses"]},
+                            "cond": {"$not": [{"$in": ["$$this.id", {"$ifNull": ["$doses.id", []]}]}]},
+                        }},
+                    ]},
+                }},
+                {"$set": {"count": {"$size": "$doses"}}},
+            ], upsert=True)
+            for key, bucket in buckets.items()
+        ], ordered=False)
+
+    async def iter(self, user_id: str, since=None, until=None, limit: Optional[int] = None):
+        in_range = _time_range(since, until)
+        cursor = self.collection.find(self._bucket_query(user_id, since, until), {"_id": 0, "doses": 1})
+        emitted = 0
+        async for bucket in cursor.sort("day", DESCENDING):
+            doses = sorted(bucket["doses"], key=lambda dose: dose["taken_at"], reverse=True)
+            for dose in doses:
+                if "$gte" in in_range and dose["taken_at"] < in_range["$gte"]:
+                    continue
+                if "$lt" in in_range and dose["taken_at"] >= in_range["$lt"]:
+                    continue
+                dose["user_id"] = user_id
+                yield dose
+                emitted += 1
+                if limit and emitted >= limit:
+                    return
+
+    async def status_counts(self, user_id: str, since=None, until=None) -> Dict[str, int]:
+        pipeline: List[Dict[str, Any]] = [
+            {"$match": self._bucket_query(user_id, since, until)},
+            {"$unwind": "$doses"},
+        ]
+        in_range = _time_range(since, until)
+        if in_range:
+            pipeline.append({"$match": {"doses.taken_at": in_range}})
+        pipeline.append({"$group": {"_id": "$doses.status", "count": {"$sum": 1}}})
+        return {row["_id"]: row["count"] async for row in self.collection.aggregate(pipeline)}
+
+    def dose_stages(self, since, until):
+        day = {}
+        if since is not None:
+            day["$gte"] = self._day(since)
+        if until is not None:
+            day["$lt"] = until
+        taken_at = _time_range(since, until)
+        return [
+            {"$match": {"day": day} if day else {}},
+            {"$unwind": "$doses"},
+            {"$match": {"doses.taken_at": taken_at} if taken_at else {}},
+            {"$project": {
+                "_id": 0,
+                "user_id": 1,
+                "medicine_id": "$doses.medicine_id",
+                "taken_at": "$doses.taken_at",
+                "status": "$doses.status",
+            }},
+        ]
+
+    async def iter_all(self, batch_size: int = 1000, after: Any = None):
+        if after is not None:
+            raise ValueError("Bucketed records cannot be copied from a checkpoint")
+        batch = []
+        async for bucket in self.collection.find({}).sort("_id", ASCENDING):
+            for dose in bucket["doses"]:
+                batch.append(dict(dose, user_id=bucket["user_id"]))
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    def _delete_query(self, user_id: str, ids: List[str], since=None, until=None) -> Dict[str, Any]:
+        query = self._bucket_query(user_id, since, until)
+        query["doses.id"] = {"$in": ids}
+        return query
+
+    async def delete(self, user_id: str, ids: List[str], since=None, until=None):
+        await self.collection.update_many(self._delete_query(user_id, ids, since, until), [
+            {"$set": {"doses": {"$filter": {"input": "$doses", "cond": {"$not": [{"$in": ["$$this.id", ids]}]}}}}},
+            {"$set": {"count": {"$size": "$doses"}}},
+        ])
+        await self.collection.delete_many(dict(self._bucket_query(user_id, since, until), count=0))
+
+    async def count(self) -> int:
+        rows = await self.collection.aggregate([{"$group": {"_id": None, "count": {"$sum": "$count"}}}]).to_list(1)
+        return rows[0]["count"] if rows else 0
+
+
+class CompactRecordStore(HealthRecordStore):
+    """One compactly encoded document per dose; see ``compact.py``."""
+
+    mode = "compact"
+    collection_name = "health_records_compact"
+    user_field = "u"
+    time_field = "t"
+    # ``_id`` is the record's random UUID.
+    growing_ids = False
+
+    async def setup(self):
+        await self.collection.create_index([("u", ASCENDING), ("t", DESCENDING)])
+        await self.collection.create_index([("t", DESCENDING)])
+
+    def _query(self, user_id: str, since: Optional[datetime], until: Optional[datetime]) -> Dict[str, Any]:
+        query: Dict[str, Any] = {"u": encode_id(user_id)}
+        taken_at = _time_range(since, until)
+        if taken_at:
+            query["t"] = taken_at
+        return query
+
+    async def insert(self, record: Dict[str, Any]):
+        await self.collection.insert_one(encode_record(record))
+
+    async def insert_many(self, records: List[Dict[str, Any]]):
+        # Ids are the record UUIDs, so re-copying a batch is a no-op.
+        await self._insert_new([encode_record(record) for record in records])
+
+    async def iter(self, user_id: str, since=None, until=None, limit: Optional[int] = None):
+        cursor = self.collection.find(self._query(user_id, since, until)).sort("t", DESCENDING)
+        if limit:
+            cursor = cursor.limit(limit)
+        async for document in cursor:
+            yield decode_record(document)
+
+    async def status_counts(self, user_id: str, since=None, until=None) -> Dict[str, int]:
+        pipeline = [
+            {"$match": self._query(user_id, since, until)},
+            {"$group": {"_id": "$s", "count": {"$sum": 1}}},
+        ]
+        return {decode_status(row["_id"]): row["count"] async for row in self.collection.aggregate(pipeline)}
+
+    def dose_stages(self, since, until):
+        # Reports join doses to ``medicines`` by their string ids; converting
+        # binary UUIDs back to strings inside a pipeline needs MongoDB 8.0+.
+        def uuid_string(field):
+            return {"$convert": {"input": field, "to": "string", "format": "uuid", "onError": field}}
+
+        taken_at = _time_range(since, until)
+        return [
+            {"$match": {"t": taken_at} if taken_at else {}},
+            {"$project": {
+                "_id": 0,
+                "user_id": uuid_string("$u"),
+                "medicine_id": uuid_string("$m"),
+                "taken_at": "$t",
+                "status": {"$switch": {
+                    "branches": [{"case": {"$eq": ["$s", code]}, "then": name} for name, code in STATUS_CODES.items()],
+                    "default": "$s",
+                }},
+            }},
+        ]
+
+    async def iter_all(self, batch_size: int = 1000, after: Any = None):
+        async for batch in super().iter_all(batch_size, after):
+            yield [dict(decode_record(document), _id=document["_id"]) for document in batch]
+
+    def _delete_query(self, user_id: str, ids: List[str], since=None, until=None) -> Dict[str, Any]:
+        query = self._query(user_id, since, until)
+        query["_id"] = {"$in": [encode_id(record_id) for record_id in ids]}
+        return query
+
+    async def users_with_records_before(self, cutoff: datetime) -> List[str]:
+        return [decode_id(user) for user in await super().users_with_records_before(cutoff)]
+
+
+STORES = {
+    store.mode: store
+    for store in (HealthRecordStore, TimeSeriesRecordStore, BucketedRecordStore, CompactRecordStore)
+}
+
+
+def make_record_store(database, mode: str = "collection") -> HealthRecordStore:
+    if mode not in STORES:
+        raise ValueError(f"Unknown health record storage mode {mode!r}, expected one of {STORAGE_MODES}")
+    return STORES[mode](database)
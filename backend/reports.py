@@ -0,0 +1,318 @@
+"""Materialized views for population-level admin analytics.
+
+Admin reports never aggregate ``health_records`` or ``medicines`` on
+request. A scheduled refresh writes small per-day summary collections
+with ``$merge`` instead, and the admin endpoints only read those:
+
+- ``report_adherence_daily``: doses taken, missed and delayed per day and
+  medicine category;
+- ``report_expiries_daily``: medicines expiring per day and category;
+- ``report_stockouts_daily``: medicines out of stock per day and category,
+  one snapshot per refresh day.
+
+Each refresh only recomputes days that new data can still change: dose
+days since the previous refresh (minus a lookback for late or backdated
+records), expiry days from today on, and today's stock-out snapshot.
+Earlier days are final. A lease in ``report_runs`` keeps several workers
+from refreshing at once.
+
+With archival on (``archive.py``), doses older than the archive horizon
+are no longer in the live store, so adherence days from the horizon back
+are never recomputed, not even on the first refresh: their rows are kept
+as last built.
+"""
+
+import asyncio
+import logging
+import time
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+
+from pymongo import ASCENDING, ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+from record_store import HealthRecordStore
+
+logger = logging.getLogger(__name__)
+
+ADHERENCE_VIEW = "report_adherence_daily"
+EXPIRIES_VIEW = "report_expiries_daily"
+STOCKOUTS_VIEW = "report_stockouts_daily"
+VIEWS = (ADHERENCE_VIEW, EXPIRIES_VIEW, STOCKOUTS_VIEW)
+
+RUN_ID = "analytics"
+
+
+def day_start(moment: datetime) -> datetime:
+    return datetime(moment.year, moment.month, moment.day)
+
+
+def _merge(view: str) -> Dict[str, Any]:
+    return {"$merge": {"into": view, "on": ["day", "category"], "whenMatched": "replace", "whenNotMatched": "insert"}}
+
+
+def _count_status(name: str) -> Dict[str, Any]:
+    return {"$sum": {"$cond": [{"$eq": ["$status", name]}, 1, 0]}}
+
+
+def adherence_pipeline(
+    store: HealthRecordStore, since: Optional[datetime], until: datetime, built_at: datetime
+) -> List[Dict[str, Any]]:
+    # Group per user and medicine first so the category lookup runs once
+    # per medicine-day rather than once per dose.
+    return store.dose_stages(since, until) + [
+        {"$group": {
+            "_id": {
+                "day": {"$dateTrunc": {"date": "$taken_at", "unit": "day"}},
+                "user_id": "$user_id",
+                "medicine_id": "$medicine_id",
+            },
+            "taken": _count_status("taken"),
+            "missed": _count_status("missed"),
+            "delayed": _count_status("delayed"),
+            "total": {"$sum": 1},
+        }},
+        {"$lookup": {
+            "from": "medicines",
+            "let": {"user_id": "$_id.user_id", "medicine_id": "$_id.medicine_id"},
+            "pipeline": [
+                {"$match": {"$expr": {"$and": [
+                    {"$eq": ["$user_id", "$$user_id"]},
+                    {"$eq": ["$id", "$$medicine_id"]},
+                ]}}},
+                {"$project": {"_id": 0, "category": 1}},
+            ],
+            "as": "medicine",
+        }},
+        {"$group": {
+            "_id": {
+                "day": "$_id.day",
+                "category": {"$ifNull": [{"$first": "$medicine.category"}, "unknown"]},
+            },
+            "taken": {"$sum": "$taken"},
+            "missed": {"$sum": "$missed"},
+            "delayed": {"$sum": "$delayed"},
+            "total": {"$sum": "$total"},
+            "users": {"$addToSet": "$_id.user_id"},
+        }},
+        {"$project": {
+            "_id": 0,
+            "day": "$_id.day",
+            "category": "$_id.category",
+            "taken": 1,
+            "missed": 1,
+            "delayed": 1,
+            "total": 1,
+            "users": {"$size": "$users"},
+            "adherence_rate": {"$round": [{"$multiply": [{"$divide": ["$taken", "$total"]}, 100]}, 1]},
+            "built_at": {"$literal": built_at},
+        }},
+        _merge(ADHERENCE_VIEW),
+    ]
+
+
+def expiries_pipeline(since: Optional[datetime], until: datetime, built_at: datetime) -> List[Dict[str, Any]]:
+    expiry_date: Dict[str, Any] = {"$lt": until}
+    if since is not None:
+        expiry_date["$gte"] = since
+    return [
+        {"$match": {"expiry_date": expiry_date}},
+        {"$group": {
+            "_id": {
+                "day": {"$dateTrunc": {"date": "$expiry_date", "unit": "day"}},
+                "category": {"$ifNull": ["$category", "general"]},
+            },
+            "medicines": {"$sum": 1},
+            "users": {"$addToSet": "$user_id"},
+        }},
+        {"$project": {
+            "_id": 0,
+            "day": "$_id.day",
+            "category": "$_id.category",
+            "medicines": 1,
+            "users": {"$size": "$users"},
+            "built_at": {"$literal": built_at},
+        }},
+        _merge(EXPIRIES_VIEW),
+    ]
+
+
+def stale_rows_query(since: Optional[datetime], built_at: datetime) -> Dict[str, Any]:
+    """Rows of recomputed days that the refresh at ``built_at`` did not write."""
+    stale: Dict[str, Any] = {"built_at": {"$lt": built_at}}
+    if since is not None:
+        stale["day"] = {"$gte": since}
+    return stale
+
+
+def view_query(
+    since: Optional[datetime] = None, until: Optional[datetime] = None, category: Optional[str] = None
+) -> Dict[str, Any]:
+    query: Dict[str, Any] = {}
+    day = {}
+    if since is not None:
+        day["$gte"] = day_start(since)
+    if until is not None:
+        day["$lt"] = until
+    if day:
+        query["day"] = day
+    if category:
+        query["category"] = category
+    return query
+
+
+def stockouts_pipeline(day: datetime, built_at: datetime) -> List[Dict[str, Any]]:
+    return [
+        {"$match": {"stock_quantity": {"$lte": 0}}},
+        {"$group": {
+            "_id": {"$ifNull": ["$category", "general"]},
+            "medicines": {"$sum": 1},
+            "users": {"$addToSet": "$user_id"},
+        }},
+        {"$project": {
+            "_id": 0,
+            "day": {"$literal": day},
+            "category": "$_id",
+            "medicines": 1,
+            "users": {"$size": "$users"},
+            "built_at": {"$literal": built_at},
+        }},
+        _merge(STOCKOUTS_VIEW),
+    ]
+
+
+class AnalyticsReports:
+    def __init__(
+        self,
+        database,
+        store: HealthRecordStore,
+        read_database=None,
+        lookback_days: int = 2,
+        expiry_horizon_days: int = 365,
+        lease_seconds: float = 600.0,
+        archive_after_days: Optional[int] = None,
+    ):
+        self.database = database
+        self.store = store
+        self.lookback_days = lookback_days
+        self.archive_after_days = archive_after_days
+        self.expiry_horizon_days = expiry_horizon_days
+        self.lease_seconds = lease_seconds
+        self.runs = database.report_runs
+        # Admin reads may use a handle that prefers secondaries; refreshes
+        # always write through ``database``.
+        self.views = {view: (read_database or database)[view] for view in VIEWS}
+
+    async def setup(self):
+        for view in VIEWS:
+            await self.database[view].create_index([("day", ASCENDING), ("category", ASCENDING)], unique=True)
+        # Cross-user scans of medicines made by the refresh.
+        await self.database.medicines.create_index([("expiry_date", ASCENDING)])
+        await self.database.medicines.create_index(
+            [("stock_quantity", ASCENDING)], partialFilterExpression={"stock_quantity": {"$lte": 0}}
+        )
+
+    # Refresh
+    async def _claim(self, now: datetime) -> Optional[Dict[str, Any]]:
+        """Take the refresh lease; returns the previous run state, or None if held."""
+        try:
+            previous = await self.runs.find_one_and_update(
+                {"_id": RUN_ID, "$or": [{"running_until": None}, {"running_until": {"$lt": now}}]},
+                {"$set": {"running_until": now + timedelta(seconds=self.lease_seconds), "started_at": now}},
+                upsert=True,
+                return_document=ReturnDocument.BEFORE,
+            )
+        except DuplicateKeyError:
+            return None
+        return previous or {}
+
+    def _adherence_since(self, since: Optional[datetime], now: datetime) -> Optional[datetime]:
+        """Clamp the adherence rebuild to days whose doses are all still live."""
+        if not self.archive_after_days:
+            return since
+        # The archiver has only moved doses older than now - archive_after_days.
+        live = day_start(now - timedelta(days=self.archive_after_days)) + timedelta(days=1)
+        if since is None:
+            logger.warning("Archival is on; building adherence from %s, earlier days are not rebuilt", live.date())
+            return live
+        return max(since, live)
+
+    async def _rebuild(self, source, view: str, pipeline: List[Dict[str, Any]], since: Optional[datetime], built_at: datetime):
+        await source.aggregate(pipeline).to_list(None)
+        # $merge only upserts; drop rows of recomputed days that no longer exist.
+        await self.database[view].delete_many(stale_rows_query(since, built_at))
+
+    async def refresh(self) -> bool:
+        """Bring the views up to date; returns False if another worker holds the lease."""
+        now = datetime.utcnow()
+        previous = await self._claim(now)
+        if previous is None:
+            return False
+
+        started = time.perf_counter()
+        today = day_start(now)
+        watermark = previous.get("watermark")
+        since = day_start(watermark - timedelta(days=self.lookback_days)) if watermark else None
+        since = self._adherence_since(since, now)
+        expiries_since = today if watermark else None
+        expiries_until = today + timedelta(days=self.expiry_horizon_days)
+        medicines = self.database.medicines
+        try:
+            await self._rebuild(
+                self.store.collection, ADHERENCE_VIEW, adherence_pipeline(self.store, since, now, now), since, now
+            )
+            await self._rebuild(
+                medicines, EXPIRIES_VIEW, expiries_pipeline(expiries_since, expiries_until, now), expiries_since, now
+            )
+            await self._rebuild(medicines, STOCKOUTS_VIEW, stockouts_pipeline(today, now), today, now)
+        except Exception as e:
+            await self.runs.update_one(
+                {"_id": RUN_ID},
+                {"$set": {"last_error": repr(e)}, "$unset": {"running_until": ""}},
+            )
+            raise
+        await self.runs.update_one(
+            {"_id": RUN_ID},
+            {
+                "$set": {
+                    "watermark": now,
+                    "finished_at": datetime.utcnow(),
+                    "duration_ms": round((time.perf_counter() - started) * 1000, 1),
+                    "last_error": None,
+                },
+                "$unset": {"running_until": ""},
+            },
+        )
+        return True
+
+    async def run_scheduler(self, interval_seconds: float):
+        """Background loop started by the app lifespan."""
+        while True:
+            try:
+                if await self.refresh():
+                    logger.info("Refreshed analytics views")
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Analytics view refresh failed")
+            await asyncio.sleep(interval_seconds)
+
+    # Reads
+    async def status(self) -> Dict[str, Any]:
+        state = await self.runs.find_one({"_id": RUN_ID}, {"_id": 0}) or {}
+        return {
+            "refreshed_at": state.get("watermark"),
+            "running": bool(state.get("running_until")),
+            "duration_ms": state.get("duration_ms"),
+            "last_error": state.get("last_error"),
+        }
+
+    async def read(
+        self,
+        view: str,
+        since: Optional[datetime] = None,
+        until: Optional[datetime] = None,
+        category: Optional[str] = None,
+    ) -> List[Dict[str, Any]]:
+        cursor = self.views[view].find(view_query(since, until, category), {"_id": 0, "built_at": 0}).sort([("day", ASCENDING), ("category", ASCENDING)])
+        return await cursor.to_list(None)
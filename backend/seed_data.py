@@ -0,0 +1,216 @@
+#!/usr/bin/env python3
+"""Fill a MongoDB database with deterministic synthetic HealthHub data.
+
+    python seed_data.py --users 10000 --medicines-per-user 4 --family-size 4 --years 2
+
+Reads MONGO_URL/DB_NAME like the server (``--db`` overrides the name) and
+writes users, family links, medicines and dose history with unordered
+bulk inserts. The same arguments, ``--seed`` and ``--until`` date
+(default: today, UTC) always produce the same documents. Dose history goes through the configured health record store,
+so it lands in whatever layout HEALTH_RECORDS_STORAGE selects. Every
+user's password is ``password``.
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import time
+import uuid
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterator, List, Optional
+
+from interactions import DEFAULT_DATASET
+from record_store import STORAGE_MODES, HealthRecordStore, make_record_store
+from server import Settings, connect, ensure_indexes, hash_password
+
+ALLERGIES = ["penicillin", "sulfa", "aspirin", "codeine", "latex", "peanuts", "cephalosporin", "nsaid"]
+BLOOD_TYPES = ["A+", "A-", "B+", "B-", "AB+", "AB-", "O+", "O-"]
+CATEGORIES = ["general", "pain_relief", "antibiotics", "vitamins", "cardiac", "diabetes"]
+FREQUENCIES = {"daily": 1, "twice_daily": 2, "three_times_daily": 3, "weekly": 1 / 7}
+STATUSES = (("taken", 88), ("missed", 8), ("delayed", 4))
+
+
+class Generator:
+    def __init__(self, seed: int = 42, until: Optional[datetime] = None):
+        self.rng = random.Random(seed)
+        # Dose history ends here; pinning it keeps the output reproducible.
+        self.until = until or datetime.combine(datetime.utcnow().date(), datetime.min.time())
+        with open(DEFAULT_DATASET, encoding="utf-8") as handle:
+            self.drug_names = sorted(json.load(handle)["drugs"])
+        self.statuses, self.status_weights = zip(*STATUSES)
+
+    def uuid(self) -> str:
+        return str(uuid.UUID(int=self.rng.getrandbits(128), version=4))
+
+    def users(self, count: int, family_size: int, password_hash: str) -> List[Dict[str, Any]]:
+        users = []
+        for index in range(count):
+            created_at = self.until - timedelta(days=self.rng.randrange(30, 1500))
+            users.append({
+                "id": self.uuid(),
+                "email": f"user{index:07d}@example.com",
+                "full_name": f"Synthetic User {index}",
+                "phone": None,
+                "date_of_birth": self.until - timedelta(days=self.rng.randrange(18 * 365, 90 * 365)),
+                "blood_type": self.rng.choice(BLOOD_TYPES),
+                "allergies": self.rng.sample(ALLERGIES, self.rng.choice((0, 0, 1, 1, 2))),
+                "emergency_contacts": [],
+                "family_members": [],
+                "role": "admin" if index == 0 else "user",
+                "password_hash": password_hash,
+                "created_at": created_at,
+                "updated_at": created_at,
+            })
+        if family_size > 1:
+            for start in range(0, count, family_size):
+                family = users[start:start + family_size]
+                for member in family:
+                    member["family_members"] = [other["id"] for other in family if other is not member]
+        return users
+
+    def medicines(self, user: Dict[str, Any], count: int) -> List[Dict[str, Any]]:
+        medicines = []
+        for name in self.rng.sample(self.drug_names, min(count, len(self.drug_names))):
+            created_at = user["created_at"] + timedelta(days=self.rng.randrange(0, 30))
+            medicines.append({
+                "id": self.uuid(),
+                "user_id": user["id"],
+                "name": name.title(),
+                "dosage": f"{self.rng.choice((5, 10, 20, 50, 100, 250, 500))}mg",
+                "frequency": self.rng.choice(list(FREQUENCIES)),
+                "instructions": None,
+                "stock_quantity": self.rng.randrange(0, 120),
+                "expiry_date": self.until + timedelta(days=self.rng.randrange(-60, 720)),
+                "category": self.rng.choice(CATEGORIES),
+                "prescription_image": None,
+                "reminders": [],
+                "created_at": created_at,
+                "updated_at": created_at,
+            })
+        return medicines
+
+    def doses(self, medicine: Dict[str, Any], days: int) -> Iterator[Dict[str, Any]]:
+        per_day = FREQUENCIES[medicine["frequency"]]
+        start = self.until - timedelta(days=days)
+        step = timedelta(days=1 / per_day)
+        taken_at = start + timedelta(hours=8, minutes=self.rng.randrange(60))
+        while taken_at < self.until:
+            status = self.rng.choices(self.statuses, self.status_weights)[0]
+            jitter = timedelta(minutes=self.rng.randrange(-20, 90 if status == "delayed" else 20))
+            yield {
+                "id": self.uuid(),
+                "user_id": medicine["user_id"],
+                "medicine_id": medicine["id"],
+                "taken_at": taken_at + jitter,
+                "status": status,
+                "notes": None,
+                "created_at": taken_at + jitter,
+            }
+            taken_at += step
+
+
+async def _flush(pending: List[asyncio.Task], limit: int):
+    if len(pending) >= limit:
+        await asyncio.gather(*pending)
+        pending.clear()
+
+
+async def generate(
+    database,
+    store: HealthRecordStore,
+    users: int = 100,
+    medicines_per_user: int = 4,
+    family_size: int = 4,
+    years: float = 1.0,
+    seed: int = 42,
+    until: Optional[datetime] = None,
+    batch_size: int = 10000,
+    concurrency: int = 4,
+) -> Dict[str, int]:
+    """Write a synthetic data set; returns document counts per collection."""
+    generator = Generator(seed, until)
+    user_docs = generator.users(users, family_size, hash_password("password"))
+    counts = {"users": len(user_docs), "medicines": 0, "health_records": 0}
+    pending: List[asyncio.Task] = []
+
+    for start in range(0, len(user_docs), batch_size):
+        pending.append(asyncio.ensure_future(
+            database.users.insert_many(user_docs[start:start + batch_size], ordered=False)
+        ))
+        await _flush(pending, concurrency)
+
+    medicines: List[Dict[str, Any]] = []
+    doses: List[Dict[str, Any]] = []
+    days = int(years * 365)
+    for user in user_docs:
+        for medicine in generator.medicines(user, medicines_per_user):
+            medicines.append(medicine)
+            for dose in generator.doses(medicine, days):
+                doses.append(dose)
+                if len(doses) >= batch_size:
+                    pending.append(asyncio.ensure_future(store.insert_many(doses)))
+                    counts["health_records"] += len(doses)
+                    doses = []
+                    await _flush(pending, concurrency)
+        if len(medicines) >= batch_size:
+            pending.append(asyncio.ensure_future(database.medicines.insert_many(medicines, ordered=False)))
+            counts["medicines"] += len(medicines)
+            medicines = []
+            await _flush(pending, concurrency)
+
+    if medicines:
+        pending.append(asyncio.ensure_future(database.medicines.insert_many(medicines, ordered=False)))
+        counts["medicines"] += len(medicines)
+    if doses:
+        pending.append(asyncio.ensure_future(store.insert_many(doses)))
+        counts["health_records"] += len(doses)
+    await _flush(pending, 1)
+    return counts
+
+
+async def main_async(args):
+    settings = Settings.from_env()
+    client = connect(settings)
+    database = client[args.db or settings.db_name]
+    store = make_record_store(database, args.storage or settings.health_records_storage)
+    if args.drop:
+        await client.drop_database(database.name)
+    await ensure_indexes(database)
+    await store.setup()
+
+    started = time.perf_counter()
+    counts = await generate(
+        database, store,
+        users=args.users,
+        medicines_per_user=args.medicines_per_user,
+        family_size=args.family_size,
+        years=args.years,
+        seed=args.seed,
+        until=args.until,
+        batch_size=args.batch_size,
+    )
+    elapsed = time.perf_counter() - started
+    total = sum(counts.values())
+    print(f"Wrote {counts} to {database.name} ({store.mode} layout) "
+          f"in {elapsed:.1f}s, {total / elapsed:,.0f} docs/s")
+    client.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--medicines-per-user", type=int, default=4)
+    parser.add_argument("--family-size", type=int, default=4, help="users per family, 1 for none")
+    parser.add_argument("--years", type=float, default=1.0, help="years of dose history per medicine")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--until", type=datetime.fromisoformat, help="end of dose history, YYYY-MM-DD")
+    parser.add_argument("--batch-size", type=int, default=10000)
+    parser.add_argument("--storage", choices=STORAGE_MODES, help="health record layout (default: setting)")
+    parser.add_argument("--db", help="database name (default: DB_NAME)")
+    parser.add_argument("--drop", action="store_true", help="drop the database first")
+    asyncio.run(main_async(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
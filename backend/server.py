@@ -1,27 +1,116 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Depends, status
+import time
+_IMPORT_STARTED = time.perf_counter()
+
+from fastapi import FastAPI, APIRouter, HTTPException, Depends, Header, Query, Request, status
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, StreamingResponse
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
-from motor.motor_asyncio import AsyncIOMotorClient
+from contextlib import asynccontextmanager
+import asyncio
+import json
 import os
 import logging
 from pathlib import Path
 from pydantic import BaseModel, Field, EmailStr
-from typing import List, Optional, Dict, Any
+from typing import TYPE_CHECKING, AsyncIterable, List, Optional, Dict, Any, Type
 import uuid
 from datetime import datetime, timedelta
 import jwt
 import bcrypt
 from bson import ObjectId
+from pymongo import InsertOne, UpdateOne
+from pymongo.errors import BulkWriteError
 import base64
+from interactions import InteractionIndex
+from record_store import HealthRecordStore, make_record_store
+from archive import HealthHistory, make_archive
+from events import EventHub, make_event_hub
+from cache import ResultCache
+from jobs import JobQueue
+from mongo_pool import PoolMetrics, read_preference
+from idempotency import IdempotencyConflict, IdempotencyKeys, IdempotencyMismatch, fingerprint
+from reports import ADHERENCE_VIEW, EXPIRIES_VIEW, STOCKOUTS_VIEW, AnalyticsReports
+
+if TYPE_CHECKING:
+    from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorDatabase
 
 ROOT_DIR = Path(__file__).parent
-load_dotenv(ROOT_DIR / '.env')
 
-# MongoDB connection
-mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
-db = client[os.environ['DB_NAME']]
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+class Settings(BaseModel):
+    mongo_url: str
+    db_name: str
+    mongo_max_pool_size: int = 100
+    mongo_min_pool_size: int = 10
+    mongo_connect_timeout_ms: int = 5000
+    mongo_server_selection_timeout_ms: int = 5000
+    mongo_socket_timeout_ms: Optional[int] = None
+    mongo_wait_queue_timeout_ms: Optional[int] = None  # wait for a free connection indefinitely when unset
+    mongo_compressors: Optional[str] = None  # e.g. zstd,snappy,zlib
+    mongo_read_preference: str = "primary"
+    mongo_max_staleness_seconds: Optional[int] = None
+    # Handle for analytics reads (adherence, expiries, admin reports)
+    analytics_read_preference: str = "primary"  # e.g. secondaryPreferred
+    analytics_max_staleness_seconds: Optional[int] = None  # at least 90 when set
+    health_records_storage: str = "collection"  # collection, timeseries, buckets, compact
+    archive_after_days: Optional[int] = None  # archival disabled when unset
+    archive_backend: str = "mongo"  # mongo, files
+    archive_path: Optional[str] = None
+    archive_interval_seconds: int = 3600
+    event_broker: str = "local"  # local, mongo (shares events between workers)
+    event_buffer_size: int = 100
+    result_cache_ttl_seconds: float = 5.0
+    result_cache_max_entries: int = 10000
+    job_workers: int = 4
+    job_max_attempts: int = 5
+    job_drain_timeout_seconds: float = 10.0
+    idempotency_ttl_seconds: int = 24 * 3600
+    idempotency_cache_max_entries: int = 10000
+    idempotency_cache_max_bytes: int = 64 * 1024 * 1024
+    report_interval_seconds: int = 900  # 0 disables the scheduled view refresh
+    report_lookback_days: int = 2
+    ensure_indexes: bool = True
+    startup_self_test: bool = True
+    cors_origins: List[str] = ["*"]
+
+    @staticmethod
+    def load_dotenv():
+        from dotenv import load_dotenv
+        load_dotenv(ROOT_DIR / '.env')
+
+    @classmethod
+    def from_env(cls) -> "Settings":
+        cls.load_dotenv()
+        env = {
+            name: os.environ[name.upper()]
+            for name in cls.model_fields
+            if name.upper() in os.environ
+        }
+        if "cors_origins" in env:
+            env["cors_origins"] = env["cors_origins"].split(",")
+        return cls(**env)
+
+# MongoDB connection, opened by the app lifespan. ``db`` serves the CRUD
+# routes; ``analytics_db`` is the same pool with its own read preference.
+client: Optional["AsyncIOMotorClient"] = None
+db: Optional["AsyncIOMotorDatabase"] = None
+analytics_db: Optional["AsyncIOMotorDatabase"] = None
+pool_metrics = PoolMetrics()
+record_store: Optional[HealthRecordStore] = None
+health_history: Optional[HealthHistory] = None
+analytics_history: Optional[HealthHistory] = None
+event_hub: Optional[EventHub] = None
+result_cache = ResultCache()
+job_queue: Optional[JobQueue] = None
+reports: Optional[AnalyticsReports] = None
+idempotency_keys: Optional[IdempotencyKeys] = None
 
 # JWT Configuration
 JWT_SECRET = "healthhub_secret_key_2024"
@@ -31,8 +120,8 @@ JWT_EXPIRATION_HOURS = 24
 # Security
 security = HTTPBearer()
 
-# Create the main app
-app = FastAPI(title="HealthHub API", version="1.0.0")
+# Drug/allergen reference index, loaded on startup
+interaction_index: Optional[InteractionIndex] = None
 
 # Create a router with the /api prefix
 api_router = APIRouter(prefix="/api")
@@ -93,6 +182,31 @@ class MedicineCreate(BaseModel):
     prescription_image: Optional[str] = None
     reminders: Optional[List[Dict[str, Any]]] = []
 
+class InteractionWarning(BaseModel):
+    type: str  # allergy, cross_reactivity, interaction
+    severity: str  # minor, moderate, major
+    medicine_name: str
+    medicine_id: Optional[str] = None
+    conflicts_with: Optional[str] = None
+    conflicts_with_id: Optional[str] = None
+    description: str
+
+class MedicineResponse(Medicine):
+    interaction_warnings: List[InteractionWarning] = []
+
+class MedicineBatchItem(MedicineCreate):
+    id: Optional[str] = None  # update this existing medicine instead of creating one
+
+class MedicineBatchResult(BaseModel):
+    index: int
+    id: str
+    status: str  # created, updated, failed
+    error: Optional[str] = None
+    interaction_warnings: List[InteractionWarning] = []
+
+MEDICINE_BATCH_LIMIT = 1000
+STREAM_CHUNK_BYTES = 64 * 1024
+
 class HealthRecord(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
     user_id: str
@@ -161,6 +275,120 @@ async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(s
         )
     return User(**user)
 
+# Query filters, also explained by tests/test_query_plans.py
+def medicine_key(user_id: str, medicine_id: str) -> Dict[str, Any]:
+    return {"id": medicine_id, "user_id": user_id}
+
+def is_canonical_uuid(value: str) -> bool:
+    try:
+        return str(uuid.UUID(value)) == value
+    except ValueError:
+        return False
+
+def user_medicines_query(user_id: str, exclude_id: Optional[str] = None) -> Dict[str, Any]:
+    query: Dict[str, Any] = {"user_id": user_id}
+    if exclude_id:
+        query["id"] = {"$ne": exclude_id}
+    return query
+
+def expiring_medicines_query(user_id: str, now: datetime, days: int = 30) -> Dict[str, Any]:
+    return {"user_id": user_id, "expiry_date": {"$lte": now + timedelta(days=days), "$gte": now}}
+
+def idempotency_key(user_id: str, route: str, key: str) -> str:
+    return f"{user_id}:{route}:{key}"
+
+async def check_interactions(medicine_name: str, user: User, exclude_id: Optional[str] = None) -> List[InteractionWarning]:
+    if interaction_index is None:
+        return []
+    current = await db.medicines.find(
+        user_medicines_query(user.id, exclude_id), {"_id": 0, "id": 1, "name": 1}
+    ).to_list(1000)
+    warnings = interaction_index.check(medicine_name, user.allergies, current)
+    return [InteractionWarning(**warning) for warning in warnings]
+
+async def require_admin(current_user: User = Depends(get_current_user)):
+    if current_user.role != "admin":
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Admin access required"
+        )
+    return current_user
+
+def data_changed(*user_ids: str):
+    # Cached reads are keyed by a per-user data version; bump it on writes.
+    result_cache.invalidate(*user_ids)
+
+EVENT_KEEPALIVE_SECONDS = 15
+
+async def publish_change(kind: str, user: User, data: Dict[str, Any]):
+    # Change events go to the user and their family; a failed publish must
+    # never fail the write that triggered it.
+    if event_hub is None:
+        return
+    try:
+        await event_hub.publish(kind, user.id, [user.id] + list(user.family_members or []), data)
+    except Exception:
+        logger.exception("Failed to publish %s event", kind)
+
+def medicine_event_data(medicine: Dict[str, Any]) -> Dict[str, Any]:
+    return {key: value for key, value in medicine.items() if key not in ("_id", "prescription_image")}
+
+async def run_idempotent(key: Optional[str], user: User, route: str, payload: BaseModel, create):
+    # Without a key the request just runs; with one, a retry gets the stored
+    # response of the first run and writes nothing.
+    if not key:
+        return await create()
+    
+    async def handler():
+        return jsonable_encoder(await create())
+    
+    try:
+        body, replayed = await idempotency_keys.run(
+            idempotency_key(user.id, route, key), fingerprint(jsonable_encoder(payload)), handler
+        )
+    except IdempotencyConflict:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="A request with this Idempotency-Key is still being processed"
+        )
+    except IdempotencyMismatch:
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail="Idempotency-Key was already used with a different request"
+        )
+    return JSONResponse(body, headers={"Idempotent-Replayed": "true"} if replayed else None)
+
+def stream_json_array(documents: AsyncIterable[Dict[str, Any]], model: Type[BaseModel]) -> StreamingResponse:
+    # Encode one document at a time: the list is never held in memory as a
+    # whole, and the first bytes go out before the last document is read.
+    # Documents are sent in chunks of about STREAM_CHUNK_BYTES rather than
+    # one write each.
+    async def body():
+        chunk = ["["]
+        size = 1
+        separator = ""
+        async for document in documents:
+            # Same bytes as json.dumps(jsonable_encoder(...)) with compact
+            # separators, but encoded by pydantic-core, several times faster.
+            encoded = separator + model(**document).model_dump_json()
+            chunk.append(encoded)
+            size += len(encoded)
+            separator = ","
+            if size >= STREAM_CHUNK_BYTES:
+                yield "".join(chunk)
+                chunk, size = [], 0
+        chunk.append("]")
+        yield "".join(chunk)
+    
+    return StreamingResponse(body(), media_type="application/json")
+
+def format_sse(kind: str, data: Dict[str, Any], event_id: Optional[int] = None) -> str:
+    lines = [f"event: {kind}"]
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    lines.append(f"data: {json.dumps(jsonable_encoder(data))}")
+    return "\n".join(lines) + "\n\n"
+
 # Auth Routes
 @api_router.post("/auth/register")
 async def register(user_data: UserCreate):
@@ -233,66 +461,186 @@ async def get_me(current_user: User = Depends(get_current_user)):
 
 # Medicine Routes
 @api_router.get("/medicines", response_model=List[Medicine])
-async def get_medicines(current_user: User = Depends(get_current_user)):
-    medicines = await db.medicines.find({"user_id": current_user.id}).to_list(1000)
+async def get_medicines(stream: bool = Query(False), current_user: User = Depends(get_current_user)):
+    cursor = db.medicines.find(user_medicines_query(current_user.id)).limit(1000)
+    if stream:
+        return stream_json_array(cursor, Medicine)
+    medicines = await cursor.to_list(1000)
     return [Medicine(**medicine) for medicine in medicines]
 
-@api_router.post("/medicines", response_model=Medicine)
-async def create_medicine(medicine_data: MedicineCreate, current_user: User = Depends(get_current_user)):
-    medicine_dict = medicine_data.dict()
-    medicine_dict["user_id"] = current_user.id
+@api_router.post("/medicines", response_model=MedicineResponse)
+async def create_medicine(
+    medicine_data: MedicineCreate,
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key", max_length=255),
+    current_user: User = Depends(get_current_user)
+):
+    async def create():
+        medicine_dict = medicine_data.dict()
+        medicine_dict["user_id"] = current_user.id
+        
+        medicine = Medicine(**medicine_dict)
+        warnings = await check_interactions(medicine.name, current_user)
+        await db.medicines.insert_one(medicine.dict())
+        data_changed(current_user.id)
+        await publish_change("medicine.created", current_user, medicine_event_data(medicine.dict()))
+        return MedicineResponse(**medicine.dict(), interaction_warnings=warnings)
+    
+    return await run_idempotent(idempotency_key, current_user, "medicines.create", medicine_data, create)
+
+@api_router.post("/medicines/batch")
+async def create_medicines_batch(items: List[MedicineBatchItem], current_user: User = Depends(get_current_user)):
+    if not items:
+        return {"results": [], "created": 0, "updated": 0, "failed": 0}
+    if len(items) > MEDICINE_BATCH_LIMIT:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"At most {MEDICINE_BATCH_LIMIT} medicines per batch"
+        )
+    
+    existing = {
+        medicine["id"]: medicine
+        for medicine in await db.medicines.find(
+            {"user_id": current_user.id}, {"_id": 0, "id": 1, "name": 1}
+        ).to_list(None)
+    }
+    
+    now = datetime.utcnow()
+    operations = []
+    # Result of each operation, by position, to map bulk write errors back.
+    written = []
+    results = []
+    updating = set()
+    for index, item in enumerate(items):
+        data = item.dict(exclude={"id"})
+        if item.id:
+            # Only the user's own medicines can be updated; ids are never
+            # chosen by the client for new ones.
+            error = None
+            if not is_canonical_uuid(item.id):
+                error = "Invalid medicine id"
+            elif item.id not in existing:
+                error = "Medicine not found"
+            elif item.id in updating:
+                error = "Medicine appears more than once in the batch"
+            if error:
+                results.append(MedicineBatchResult(index=index, id=item.id, status="failed", error=error))
+                continue
+            updating.add(item.id)
+            data["updated_at"] = now
+            operations.append(UpdateOne(medicine_key(current_user.id, item.id), {"$set": data}))
+            result = MedicineBatchResult(index=index, id=item.id, status="updated")
+        else:
+            medicine = Medicine(**data, user_id=current_user.id)
+            operations.append(InsertOne(medicine.dict()))
+            result = MedicineBatchResult(index=index, id=medicine.id, status="created")
+        written.append(result)
+        results.append(result)
     
-    medicine = Medicine(**medicine_dict)
-    await db.medicines.insert_one(medicine.dict())
-    return medicine
+    if operations:
+        try:
+            await db.medicines.bulk_write(operations, ordered=False)
+        except BulkWriteError as e:
+            for error in e.details.get("writeErrors", []):
+                result = written[error["index"]]
+                result.status = "failed"
+                result.error = error.get("errmsg")
+        data_changed(current_user.id)
+    
+    # Check each stored item once against the user's medicine list as it
+    # stands after the whole batch, not after each individual write.
+    final = {medicine_id: medicine["name"] for medicine_id, medicine in existing.items()}
+    for item, result in zip(items, results):
+        if result.status != "failed":
+            final[result.id] = item.name
+    if interaction_index is not None:
+        allergy_ids = interaction_index.resolve_allergies(current_user.allergies)
+        medicines = [{"id": medicine_id, "name": name} for medicine_id, name in final.items()]
+        for item, result in zip(items, results):
+            if result.status == "failed":
+                continue
+            others = [medicine for medicine in medicines if medicine["id"] != result.id]
+            result.interaction_warnings = [
+                InteractionWarning(**warning)
+                for warning in interaction_index.check(item.name, None, others, allergy_ids)
+            ]
+    
+    summary = {
+        "created": sum(1 for result in results if result.status == "created"),
+        "updated": sum(1 for result in results if result.status == "updated"),
+        "failed": sum(1 for result in results if result.status == "failed"),
+    }
+    await publish_change("medicine.batch", current_user, {
+        **summary,
+        "ids": [result.id for result in results if result.status != "failed"],
+    })
+    return {"results": results, **summary}
 
 @api_router.get("/medicines/{medicine_id}", response_model=Medicine)
 async def get_medicine(medicine_id: str, current_user: User = Depends(get_current_user)):
-    medicine = await db.medicines.find_one({"id": medicine_id, "user_id": current_user.id})
+    medicine = await db.medicines.find_one(medicine_key(current_user.id, medicine_id))
     if not medicine:
         raise HTTPException(status_code=404, detail="Medicine not found")
     return Medicine(**medicine)
 
-@api_router.put("/medicines/{medicine_id}", response_model=Medicine)
+@api_router.put("/medicines/{medicine_id}", response_model=MedicineResponse)
 async def update_medicine(medicine_id: str, medicine_data: MedicineCreate, current_user: User = Depends(get_current_user)):
-    medicine = await db.medicines.find_one({"id": medicine_id, "user_id": current_user.id})
+    medicine = await db.medicines.find_one(medicine_key(current_user.id, medicine_id))
     if not medicine:
         raise HTTPException(status_code=404, detail="Medicine not found")
     
     update_data = medicine_data.dict()
     update_data["updated_at"] = datetime.utcnow()
     
-    await db.medicines.update_one(
-        {"id": medicine_id, "user_id": current_user.id},
-        {"$set": update_data}
-    )
+    await db.medicines.update_one(medicine_key(current_user.id, medicine_id), {"$set": update_data})
     
-    updated_medicine = await db.medicines.find_one({"id": medicine_id, "user_id": current_user.id})
-    return Medicine(**updated_medicine)
+    data_changed(current_user.id)
+    updated_medicine = await db.medicines.find_one(medicine_key(current_user.id, medicine_id))
+    warnings = await check_interactions(updated_medicine["name"], current_user, exclude_id=medicine_id)
+    await publish_change("medicine.updated", current_user, medicine_event_data(updated_medicine))
+    return MedicineResponse(**updated_medicine, interaction_warnings=warnings)
 
 @api_router.delete("/medicines/{medicine_id}")
 async def delete_medicine(medicine_id: str, current_user: User = Depends(get_current_user)):
-    result = await db.medicines.delete_one({"id": medicine_id, "user_id": current_user.id})
+    result = await db.medicines.delete_one(medicine_key(current_user.id, medicine_id))
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Medicine not found")
+    data_changed(current_user.id)
+    await publish_change("medicine.deleted", current_user, {"id": medicine_id})
     return {"message": "Medicine deleted successfully"}
 
 # Health Records Routes
 @api_router.get("/health-records", response_model=List[HealthRecord])
-async def get_health_records(current_user: User = Depends(get_current_user)):
-    records = await db.health_records.find({"user_id": current_user.id}).sort("taken_at", -1).to_list(1000)
+async def get_health_records(
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    limit: int = Query(1000, ge=1, le=10000),
+    stream: bool = Query(False),
+    current_user: User = Depends(get_current_user)
+):
+    if stream:
+        return stream_json_array(health_history.iter(current_user.id, since=since, until=until, limit=limit), HealthRecord)
+    records = await health_history.find(current_user.id, since=since, until=until, limit=limit)
     return [HealthRecord(**record) for record in records]
 
 @api_router.post("/health-records", response_model=HealthRecord)
-async def create_health_record(record_data: HealthRecordCreate, current_user: User = Depends(get_current_user)):
-    record_dict = record_data.dict()
-    record_dict["user_id"] = current_user.id
-    if not record_dict.get("taken_at"):
-        record_dict["taken_at"] = datetime.utcnow()
+async def create_health_record(
+    record_data: HealthRecordCreate,
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key", max_length=255),
+    current_user: User = Depends(get_current_user)
+):
+    async def create():
+        record_dict = record_data.dict()
+        record_dict["user_id"] = current_user.id
+        if not record_dict.get("taken_at"):
+            record_dict["taken_at"] = datetime.utcnow()
+        
+        record = HealthRecord(**record_dict)
+        await health_history.insert(record.dict())
+        data_changed(current_user.id)
+        await publish_change("health_record.created", current_user, record.dict())
+        return record
     
-    record = HealthRecord(**record_dict)
-    await db.health_records.insert_one(record.dict())
-    return record
+    return await run_idempotent(idempotency_key, current_user, "health_records.create", record_data, create)
 
 # Family Management Routes
 @api_router.post("/family/invite")
@@ -304,39 +652,101 @@ async def invite_family_member(invite_data: FamilyInviteCreate, current_user: Us
     invite_dict["inviter_id"] = current_user.id
     
     invite = FamilyInvite(**invite_dict)
-    await db.family_invites.insert_one(invite.dict())
+    job_id = await job_queue.enqueue("family.invite", {
+        "invite": invite.dict(),
+        "invitee_id": existing_user["id"] if existing_user else None
+    })
     
+    # The background job records the invite, and links the families if the
+    # user exists, after this response is sent.
     if existing_user:
-        # Add to family immediately if user exists
-        await db.users.update_one(
-            {"id": current_user.id},
-            {"$addToSet": {"family_members": existing_user["id"]}}
-        )
-        await db.users.update_one(
-            {"id": existing_user["id"]},
-            {"$addToSet": {"family_members": current_user.id}}
-        )
-        
-        return {"message": f"Added {invite_data.invitee_email} to family"}
-    
-    return {"message": f"Invitation sent to {invite_data.invitee_email}"}
+        message = f"{invite_data.invitee_email} will be added to your family shortly"
+    else:
+        message = f"Invitation to {invite_data.invitee_email} queued"
+    return {"message": message, "invite_id": invite.id, "job_id": job_id}
 
 @api_router.get("/family/members")
 async def get_family_members(current_user: User = Depends(get_current_user)):
     if not current_user.family_members:
         return []
     
+    async def load():
+        members = await db.users.find(
+            {"id": {"$in": current_user.family_members}},
+            {"_id": 0, "id": 1, "full_name": 1, "email": 1, "blood_type": 1, "allergies": 1}
+        ).to_list(1000)
+        
+        return [
+            {
+                "id": member["id"],
+                "full_name": member["full_name"],
+                "email": member["email"],
+                "blood_type": member.get("blood_type"),
+                "allergies": member.get("allergies", [])
+            }
+            for member in members
+        ]
+    
+    return await result_cache.get_or_load("family_members", current_user.id, load)
+
+# Live Updates
+@api_router.get("/events")
+async def stream_events(request: Request, current_user: User = Depends(get_current_user)):
+    """Server-Sent Events stream of changes made by the user or their family."""
+    subscription = event_hub.subscribe(current_user.id)
+    
+    async def event_stream():
+        try:
+            yield "retry: 3000\n\n"
+            while not subscription.closed and not await request.is_disconnected():
+                event = await subscription.get(EVENT_KEEPALIVE_SECONDS)
+                dropped = subscription.take_dropped()
+                if dropped:
+                    yield format_sse("overflow", {"dropped": dropped})
+                if event is not None:
+                    data = {key: event[key] for key in ("type", "user_id", "data", "at")}
+                    yield format_sse(event["type"], data, event["seq"])
+                elif not subscription.closed:
+                    yield ": keepalive\n\n"
+        finally:
+            event_hub.unsubscribe(subscription)
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+# Interaction Check Routes
+@api_router.post("/interactions/check", response_model=List[InteractionWarning])
+async def check_medicine_interactions(medicine_data: MedicineCreate, current_user: User = Depends(get_current_user)):
+    return await check_interactions(medicine_data.name, current_user)
+
+@api_router.get("/interactions/family-audit")
+async def audit_family_interactions(current_user: User = Depends(get_current_user)):
+    if interaction_index is None:
+        raise HTTPException(status_code=503, detail="Interaction index not loaded")
+    
+    member_ids = [current_user.id] + list(current_user.family_members or [])
     members = await db.users.find(
-        {"id": {"$in": current_user.family_members}}
+        {"id": {"$in": member_ids}},
+        {"_id": 0, "id": 1, "full_name": 1, "allergies": 1}
     ).to_list(1000)
+    medicines = await db.medicines.find(
+        {"user_id": {"$in": member_ids}},
+        {"_id": 0, "id": 1, "user_id": 1, "name": 1}
+    ).to_list(None)
+    
+    by_user: Dict[str, List[Dict[str, Any]]] = {}
+    for medicine in medicines:
+        by_user.setdefault(medicine["user_id"], []).append(medicine)
     
     return [
         {
-            "id": member["id"],
+            "user_id": member["id"],
             "full_name": member["full_name"],
-            "email": member["email"],
-            "blood_type": member.get("blood_type"),
-            "allergies": member.get("allergies", [])
+            "medicine_count": len(by_user.get(member["id"], [])),
+            "warnings": interaction_index.audit(member.get("allergies"), by_user.get(member["id"], []))
         }
         for member in members
     ]
@@ -344,55 +754,275 @@ async def get_family_members(current_user: User = Depends(get_current_user)):
 # Health Analytics Routes
 @api_router.get("/analytics/adherence")
 async def get_adherence_stats(current_user: User = Depends(get_current_user)):
-    # Get records from last 30 days
-    thirty_days_ago = datetime.utcnow() - timedelta(days=30)
-    records = await db.health_records.find({
-        "user_id": current_user.id,
-        "taken_at": {"$gte": thirty_days_ago}
-    }).to_list(1000)
+    async def load():
+        # Get records from last 30 days
+        thirty_days_ago = datetime.utcnow() - timedelta(days=30)
+        counts = await analytics_history.status_counts(current_user.id, since=thirty_days_ago)
+        
+        total_records = sum(counts.values())
+        taken_records = counts.get("taken", 0)
+        
+        adherence_rate = (taken_records / total_records * 100) if total_records > 0 else 0
+        
+        return {
+            "adherence_rate": round(adherence_rate, 1),
+            "total_doses": total_records,
+            "taken_doses": taken_records,
+            "missed_doses": total_records - taken_records,
+            "period_days": 30
+        }
     
-    total_records = len(records)
-    taken_records = len([r for r in records if r["status"] == "taken"])
+    return await result_cache.get_or_load("adherence", current_user.id, load)
+
+@api_router.get("/analytics/upcoming-expiries")
+async def get_upcoming_expiries(current_user: User = Depends(get_current_user)):
+    async def load():
+        medicines = await analytics_db.medicines.find(
+            expiring_medicines_query(current_user.id, datetime.utcnow())
+        ).sort("expiry_date", 1).to_list(100)
+        
+        return [Medicine(**medicine) for medicine in medicines]
     
-    adherence_rate = (taken_records / total_records * 100) if total_records > 0 else 0
+    return await result_cache.get_or_load("upcoming_expiries", current_user.id, load)
+
+# Admin Reports (read only the materialized views built by reports.py)
+@api_router.get("/admin/reports/status")
+async def get_report_status(current_user: User = Depends(require_admin)):
+    return await reports.status()
+
+@api_router.get("/admin/reports/adherence")
+async def get_adherence_report(
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    category: Optional[str] = None,
+    current_user: User = Depends(require_admin)
+):
+    if since is None:
+        since = datetime.utcnow() - timedelta(days=30)
+    rows = await reports.read(ADHERENCE_VIEW, since, until, category)
     
+    by_category: Dict[str, Dict[str, int]] = {}
+    for row in rows:
+        totals = by_category.setdefault(row["category"], {"taken": 0, "missed": 0, "delayed": 0, "total": 0})
+        for key in totals:
+            totals[key] += row[key]
+    summary = [
+        {
+            "category": name,
+            **totals,
+            "adherence_rate": round(totals["taken"] / totals["total"] * 100, 1) if totals["total"] else 0
+        }
+        for name, totals in sorted(by_category.items())
+    ]
+    return {"days": rows, "by_category": summary}
+
+@api_router.get("/admin/reports/expiries")
+async def get_expiry_report(
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    category: Optional[str] = None,
+    current_user: User = Depends(require_admin)
+):
+    if since is None:
+        since = datetime.utcnow()
+    if until is None:
+        until = since + timedelta(days=90)
+    return await reports.read(EXPIRIES_VIEW, since, until, category)
+
+@api_router.get("/admin/reports/stockouts")
+async def get_stockout_report(
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    category: Optional[str] = None,
+    current_user: User = Depends(require_admin)
+):
+    if since is None:
+        since = datetime.utcnow() - timedelta(days=30)
+    return await reports.read(STOCKOUTS_VIEW, since, until, category)
+
+# Operations
+@api_router.get("/metrics")
+async def get_metrics(current_user: User = Depends(require_admin)):
     return {
-        "adherence_rate": round(adherence_rate, 1),
-        "total_doses": total_records,
-        "taken_doses": taken_records,
-        "missed_doses": total_records - taken_records,
-        "period_days": 30
+        "result_cache": result_cache.stats(),
+        "events": {"connections": event_hub.connections if event_hub else 0},
+        "jobs": job_queue.stats() if job_queue else None,
+        "idempotency_keys": idempotency_keys.stats() if idempotency_keys else None,
+        "mongo_pool": pool_metrics.stats(),
     }
 
-@api_router.get("/analytics/upcoming-expiries")
-async def get_upcoming_expiries(current_user: User = Depends(get_current_user)):
-    thirty_days_later = datetime.utcnow() + timedelta(days=30)
-    
-    medicines = await db.medicines.find({
-        "user_id": current_user.id,
-        "expiry_date": {"$lte": thirty_days_later, "$gte": datetime.utcnow()}
-    }).sort("expiry_date", 1).to_list(100)
+# Background Jobs
+async def process_family_invite(payload: Dict[str, Any]):
+    # Every step is idempotent so a retried job cannot duplicate anything.
+    invite = payload["invite"]
+    await db.family_invites.replace_one({"id": invite["id"]}, invite, upsert=True)
     
-    return [Medicine(**medicine) for medicine in medicines]
+    invitee_id = payload.get("invitee_id")
+    if invitee_id:
+        inviter_id = invite["inviter_id"]
+        await db.users.update_one(
+            {"id": inviter_id},
+            {"$addToSet": {"family_members": invitee_id}}
+        )
+        await db.users.update_one(
+            {"id": invitee_id},
+            {"$addToSet": {"family_members": inviter_id}}
+        )
+        data_changed(inviter_id, invitee_id)
 
-# Include the router in the main app
-app.include_router(api_router)
+JOB_HANDLERS = {
+    "family.invite": process_family_invite,
+}
 
-app.add_middleware(
-    CORSMiddleware,
-    allow_credentials=True,
-    allow_origins=["*"],
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
+# Startup
+INDEXES = {
+    "users": [
+        ([("email", 1)], {"unique": True}),
+        ([("id", 1)], {"unique": True}),
+    ],
+    "medicines": [
+        ([("user_id", 1), ("id", 1)], {"unique": True}),
+        ([("user_id", 1), ("expiry_date", 1)], {}),
+    ],
+    "family_invites": [
+        ([("inviter_id", 1)], {}),
+        ([("id", 1)], {"unique": True}),
+    ],
+}
 
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
-logger = logging.getLogger(__name__)
+def connect(settings: Settings) -> "AsyncIOMotorClient":
+    from motor.motor_asyncio import AsyncIOMotorClient
+    options: Dict[str, Any] = {}
+    if settings.mongo_compressors:
+        options["compressors"] = settings.mongo_compressors
+    return AsyncIOMotorClient(
+        settings.mongo_url,
+        maxPoolSize=settings.mongo_max_pool_size,
+        minPoolSize=settings.mongo_min_pool_size,
+        waitQueueTimeoutMS=settings.mongo_wait_queue_timeout_ms,
+        connectTimeoutMS=settings.mongo_connect_timeout_ms,
+        serverSelectionTimeoutMS=settings.mongo_server_selection_timeout_ms,
+        socketTimeoutMS=settings.mongo_socket_timeout_ms,
+        event_listeners=[pool_metrics],
+        **options,
+    )
+
+async def warm_up_pool(mongo_client: "AsyncIOMotorClient", connections: int):
+    # Concurrent pings each check out their own socket, so the pool is
+    # filled before the first request instead of during it.
+    await asyncio.gather(*[
+        mongo_client.admin.command("ping") for _ in range(max(connections, 1))
+    ])
+
+async def ensure_indexes(database: "AsyncIOMotorDatabase"):
+    from pymongo.errors import OperationFailure
+    for collection, indexes in INDEXES.items():
+        for keys, options in indexes:
+            try:
+                await database[collection].create_index(keys, **options)
+            except OperationFailure as e:
+                logger.warning("Could not build index %s on %s: %s", keys, collection, e)
+
+async def self_test(database: "AsyncIOMotorDatabase"):
+    await database.command("ping")
+    if interaction_index is None or not interaction_index.size["terms"]:
+        raise RuntimeError("Interaction index is empty")
+    token = create_access_token("self-test", "self-test@healthhub.local")
+    if verify_token(token)["user_id"] != "self-test":
+        raise RuntimeError("JWT round trip failed")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global client, db, analytics_db, record_store, health_history, analytics_history, event_hub, result_cache, job_queue, reports, idempotency_keys, interaction_index
+    settings = app.state.settings
+    started = time.perf_counter()
+    client = event_hub = job_queue = None
+    background = []
+    
+    # Everything opened here is closed in ``finally``, also when startup
+    # fails part way through.
+    try:
+        client = connect(settings)
+        db = client.get_database(
+            settings.db_name,
+            read_preference=read_preference(settings.mongo_read_preference, settings.mongo_max_staleness_seconds)
+        )
+        analytics_db = client.get_database(
+            settings.db_name,
+            read_preference=read_preference(settings.analytics_read_preference, settings.analytics_max_staleness_seconds)
+        )
+        archive_path = settings.archive_path or str(ROOT_DIR / "health_archive")
+        record_store = make_record_store(db, settings.health_records_storage)
+        archive = make_archive(db, settings.archive_backend, archive_path)
+        health_history = HealthHistory(record_store, archive, settings.archive_after_days)
+        analytics_history = HealthHistory(
+            make_record_store(analytics_db, settings.health_records_storage),
+            make_archive(analytics_db, settings.archive_backend, archive_path),
+            settings.archive_after_days
+        )
+        event_hub = make_event_hub(db, settings.event_broker, settings.event_buffer_size)
+        result_cache = ResultCache(settings.result_cache_ttl_seconds, settings.result_cache_max_entries)
+        job_queue = JobQueue(db.jobs, JOB_HANDLERS, settings.job_workers, settings.job_max_attempts)
+        reports = AnalyticsReports(
+            db, record_store, analytics_db, settings.report_lookback_days,
+            archive_after_days=settings.archive_after_days
+        )
+        idempotency_keys = IdempotencyKeys(
+            db.idempotency_keys, settings.idempotency_ttl_seconds, settings.idempotency_cache_max_entries,
+            cache_max_bytes=settings.idempotency_cache_max_bytes
+        )
+        interaction_index = InteractionIndex.load()
+        
+        await warm_up_pool(client, settings.mongo_min_pool_size)
+        if settings.ensure_indexes:
+            await ensure_indexes(db)
+            await record_store.setup()
+            await archive.setup()
+            await job_queue.setup()
+            await reports.setup()
+            await idempotency_keys.setup()
+        if settings.startup_self_test:
+            await self_test(db)
+        
+        logger.info(
+            "Startup complete in %.1f ms (import %.1f ms, interaction index %s)",
+            (time.perf_counter() - started) * 1000, IMPORT_SECONDS * 1000, interaction_index.size
+        )
+        await event_hub.broker.start()
+        await job_queue.start()
+        if settings.archive_after_days:
+            background.append(asyncio.create_task(health_history.run_archiver(settings.archive_interval_seconds)))
+        if settings.report_interval_seconds:
+            background.append(asyncio.create_task(reports.run_scheduler(settings.report_interval_seconds)))
+        yield
+    finally:
+        for task in background:
+            task.cancel()
+        if job_queue is not None:
+            await job_queue.stop(settings.job_drain_timeout_seconds)
+        if event_hub is not None:
+            event_hub.close()
+            await event_hub.broker.stop()
+        if client is not None:
+            client.close()
+
+def create_app(settings: Optional[Settings] = None) -> FastAPI:
+    """Serve with ``uvicorn --factory server:create_app``; reads .env here, not on import."""
+    if settings is None:
+        settings = Settings.from_env()
+    app = FastAPI(title="HealthHub API", version="1.0.0", lifespan=lifespan)
+    app.state.settings = settings
+    
+    # Include the router in the main app
+    app.include_router(api_router)
+    
+    app.add_middleware(
+        CORSMiddleware,
+        allow_credentials=True,
+        allow_origins=settings.cors_origins,
+        allow_methods=["*"],
+        allow_headers=["*"],
+    )
+    return app
 
-@app.on_event("shutdown")
-async def shutdown_db_client():
-    client.close()
+IMPORT_SECONDS = time.perf_counter() - _IMPORT_STARTED
@@ -0,0 +1,159 @@
+import asyncio
+import sys
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+mongomock_motor = pytest.importorskip("mongomock_motor")
+
+from archive import RUN_ID, FileSegmentArchive, HealthHistory, MongoSegmentArchive, SegmentArchive  # noqa: E402
+from record_store import HealthRecordStore  # noqa: E402
+
+NOW = datetime.utcnow().replace(microsecond=0)
+HORIZON_DAYS = 30
+# Days ago, with the status of each dose; the last three are past the horizon.
+DOSES = [(5, "taken"), (10, "missed"), (40, "taken"), (70, "taken"), (75, "skipped")]
+
+
+def record(n, days_ago, status, user_id="u1"):
+    return {
+        "id": f"r{n}",
+        "user_id": user_id,
+        "medicine_id": "m1",
+        "taken_at": NOW - timedelta(days=days_ago),
+        "status": status,
+    }
+
+
+@pytest.fixture(params=["mongo", "files"])
+def run(request, tmp_path):
+    def run(scenario):
+        async def main():
+            database = mongomock_motor.AsyncMongoMockClient().healthhub_test
+            archive = MongoSegmentArchive(database) if request.param == "mongo" else FileSegmentArchive(tmp_path)
+            store = HealthRecordStore(database)
+            for n, (days_ago, status) in enumerate(DOSES):
+                await store.insert(record(n, days_ago, status))
+            await scenario(HealthHistory(store, archive, HORIZON_DAYS))
+        asyncio.run(main())
+    return run
+
+
+async def live_ids(history, user_id="u1"):
+    return [record["id"] async for record in history.store.iter(user_id)]
+
+
+def test_segment_archive_is_abstract():
+    with pytest.raises(TypeError):
+        SegmentArchive()
+
+
+def test_archive_user_moves_old_records(run):
+    async def scenario(history):
+        assert await history.archive_user("u1", history.horizon) == 3
+        assert await live_ids(history) == ["r0", "r1"]
+        archived = []
+        for month in await history.archive.months("u1", None, None):
+            archived += [record["id"] for record in await history.archive.read("u1", month)]
+        assert sorted(archived) == ["r2", "r3", "r4"]
+
+        # Archiving again merges by id instead of duplicating.
+        await history.store.insert(record(2, 40, "missed"))
+        assert await history.archive_user("u1", history.horizon) == 1
+        records = await history.find("u1")
+        assert [record["id"] for record in records] == ["r0", "r1", "r2", "r3", "r4"]
+        assert records[2]["status"] == "missed"
+
+    run(scenario)
+
+
+def test_iter_reads_live_records_then_archive(run):
+    async def scenario(history):
+        await history.archive_old_records()
+        records = await history.find("u1")
+        assert [record["id"] for record in records] == ["r0", "r1", "r2", "r3", "r4"]
+        assert all(record["user_id"] == "u1" for record in records)
+        assert [record["id"] for record in await history.find("u1", limit=3)] == ["r0", "r1", "r2"]
+        assert [record["id"] for record in await history.find("u1", since=NOW - timedelta(days=72))] == ["r0", "r1", "r2", "r3"]
+        assert [record["id"] for record in await history.find("u1", until=NOW - timedelta(days=50))] == ["r3", "r4"]
+        assert await history.find("u2") == []
+
+        # A crash between the segment write and the delete leaves a copy in
+        # both places; reads return it once.
+        await history.store.insert(record(3, 70, "taken"))
+        assert sorted(record["id"] for record in await history.find("u1")) == ["r0", "r1", "r2", "r3", "r4"]
+
+    run(scenario)
+
+
+def test_iter_skips_archive_for_recent_ranges(run):
+    async def scenario(history):
+        await history.archive_old_records()
+
+        async def unreachable(*args):
+            raise AssertionError("opened the archive for a range inside the horizon")
+        history.archive.months = unreachable
+        assert [record["id"] for record in await history.find("u1", since=NOW - timedelta(days=20))] == ["r0", "r1"]
+        assert await history.status_counts("u1", since=NOW - timedelta(days=20)) == {"taken": 1, "missed": 1}
+
+    run(scenario)
+
+
+def test_status_counts_include_archived_records(run):
+    async def scenario(history):
+        before = await history.status_counts("u1")
+        await history.archive_old_records()
+        assert await history.status_counts("u1") == before == {"taken": 3, "missed": 1, "skipped": 1}
+        assert await history.status_counts("u1", since=NOW - timedelta(days=72)) == {"taken": 3, "missed": 1}
+
+    run(scenario)
+
+
+def test_archiver_skips_while_another_worker_holds_the_lease(run):
+    async def scenario(history):
+        await history.runs.insert_one(
+            {"_id": RUN_ID, "owner": "other", "running_until": datetime.utcnow() + timedelta(minutes=5)}
+        )
+        assert await history.archive_old_records() == 0
+        assert len(await live_ids(history)) == 5
+
+    run(scenario)
+
+
+def test_archiver_takes_over_an_expired_lease_and_releases_it(run):
+    async def scenario(history):
+        # Left behind by a worker that crashed mid-run.
+        await history.runs.insert_one(
+            {"_id": RUN_ID, "owner": "other", "running_until": datetime.utcnow() - timedelta(seconds=1)}
+        )
+        assert await history.archive_old_records() == 3
+        state = await history.runs.find_one({"_id": RUN_ID})
+        assert state["owner"] != "other" and "running_until" not in state
+        # Released, so the next run can claim it straight away.
+        await history.store.insert(record(9, 50, "taken", user_id="u2"))
+        assert await history.archive_old_records() == 1
+
+    run(scenario)
+
+
+def test_archiver_stops_when_its_lease_is_taken(run):
+    async def scenario(history):
+        for n in range(3):
+            await history.store.insert(record(10 + n, 50, "taken", user_id=f"u{n + 2}"))
+        archive_user = history.archive_user
+
+        async def slow_archive_user(user_id, cutoff):
+            # The lease expires and another worker claims it mid-run.
+            await history.runs.update_one({"_id": RUN_ID}, {"$set": {"owner": "other"}})
+            return await archive_user(user_id, cutoff)
+        history.archive_user = slow_archive_user
+        await history.archive_old_records()
+        # Only the user in progress when the lease was lost is archived.
+        assert len(await history.store.users_with_records_before(history.horizon)) == 3
+        state = await history.runs.find_one({"_id": RUN_ID})
+        assert state["owner"] == "other" and "running_until" in state
+
+    run(scenario)
@@ -0,0 +1,128 @@
+import asyncio
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+import cache  # noqa: E402
+from cache import ResultCache  # noqa: E402
+
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+
+class Loader:
+    def __init__(self, result="rows", gate=None):
+        self.result = result
+        self.gate = gate
+        self.calls = 0
+
+    async def __call__(self):
+        self.calls += 1
+        if self.gate is not None:
+            await self.gate.wait()
+        return self.result
+
+
+def test_concurrent_misses_share_one_load():
+    async def scenario():
+        result_cache = ResultCache()
+        loader = Loader(gate=asyncio.Event())
+        waiters = [asyncio.ensure_future(result_cache.get_or_load("medicines", "u1", loader)) for _ in range(10)]
+        await asyncio.sleep(0)
+        loader.gate.set()
+        results = await asyncio.gather(*waiters)
+        assert results == ["rows"] * 10
+        assert loader.calls == 1
+        assert await result_cache.get_or_load("medicines", "u1", loader) == "rows"
+        assert loader.calls == 1
+        return result_cache.stats()
+
+    stats = run(scenario())
+    assert (stats["misses"], stats["coalesced"], stats["hits"]) == (1, 9, 1)
+
+
+def test_load_overlapping_a_write_is_not_stored():
+    async def scenario():
+        result_cache = ResultCache()
+        loader = Loader(result="before write", gate=asyncio.Event())
+        pending = asyncio.ensure_future(result_cache.get_or_load("medicines", "u1", loader))
+        await asyncio.sleep(0)
+        result_cache.invalidate("u1")
+        loader.gate.set()
+        assert await pending == "before write"
+
+        fresh = Loader(result="after write")
+        assert await result_cache.get_or_load("medicines", "u1", fresh) == "after write"
+        assert fresh.calls == 1
+        assert result_cache.stats()["entries"] == 1
+
+    run(scenario())
+
+
+def test_write_invalidates_cached_result():
+    async def scenario():
+        result_cache = ResultCache()
+        await result_cache.get_or_load("medicines", "u1", Loader("old"))
+        await result_cache.get_or_load("medicines", "u2", Loader("other"))
+        result_cache.invalidate("u1")
+        assert await result_cache.get_or_load("medicines", "u1", Loader("new")) == "new"
+        assert await result_cache.get_or_load("medicines", "u2", Loader("unused")) == "other"
+
+    run(scenario())
+
+
+def test_entries_expire_after_ttl(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(cache.time, "monotonic", lambda: now[0])
+
+    async def scenario():
+        result_cache = ResultCache(ttl_seconds=5)
+        loader = Loader()
+        await result_cache.get_or_load("medicines", "u1", loader)
+        now[0] += 4.9
+        await result_cache.get_or_load("medicines", "u1", loader)
+        assert loader.calls == 1
+        now[0] += 0.2
+        await result_cache.get_or_load("medicines", "u1", loader)
+        assert loader.calls == 2
+
+    run(scenario())
+
+
+def test_failed_load_is_not_cached():
+    async def scenario():
+        result_cache = ResultCache()
+
+        async def failing():
+            raise RuntimeError("boom")
+
+        try:
+            await result_cache.get_or_load("medicines", "u1", failing)
+        except RuntimeError:
+            pass
+        else:
+            raise AssertionError("expected the loader error")
+        assert await result_cache.get_or_load("medicines", "u1", Loader()) == "rows"
+
+    run(scenario())
+
+
+def test_versions_are_dropped_with_their_last_key():
+    async def scenario():
+        result_cache = ResultCache(max_entries=2)
+        result_cache.invalidate(*[f"writer{n}" for n in range(100)])
+        assert result_cache.stats()["versions"] == 0
+
+        await result_cache.get_or_load("medicines", "u1", Loader())
+        result_cache.invalidate("u1")
+        assert result_cache.stats()["versions"] == 1
+        for n in range(10):
+            await result_cache.get_or_load("medicines", f"reader{n}", Loader())
+            result_cache.invalidate(f"reader{n}")
+        stats = result_cache.stats()
+        assert stats["entries"] == 2
+        assert stats["versions"] <= 2
+
+    run(scenario())
@@ -0,0 +1,68 @@
+import sys
+import uuid
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+from bson.binary import Binary  # noqa: E402
+
+from compact import decode_id, decode_record, encode_id, encode_record  # noqa: E402
+
+TAKEN_AT = datetime(2025, 1, 2, 8, 30, 0, 123000)
+
+
+def record(**overrides):
+    fields = {
+        "id": str(uuid.uuid4()),
+        "user_id": str(uuid.uuid4()),
+        "medicine_id": str(uuid.uuid4()),
+        "taken_at": TAKEN_AT,
+        "status": "taken",
+        "notes": None,
+        "created_at": TAKEN_AT,
+    }
+    fields.update(overrides)
+    return fields
+
+
+def test_canonical_uuids_are_stored_as_binary():
+    value = str(uuid.uuid4())
+    assert isinstance(encode_id(value), Binary)
+    assert decode_id(encode_id(value)) == value
+
+
+@pytest.mark.parametrize("value", [
+    "12345678123456781234567812345678",
+    "ABCDEF12-3456-7890-ABCD-EF1234567890",
+    "{12345678-1234-5678-1234-567812345678}",
+    "urn:uuid:12345678-1234-5678-1234-567812345678",
+    "aspirin-1",
+    "",
+])
+def test_other_ids_are_kept_verbatim(value):
+    assert encode_id(value) == value
+    assert decode_id(encode_id(value)) == value
+
+
+@pytest.mark.parametrize("fields", [
+    {},
+    {"medicine_id": "12345678123456781234567812345678"},
+    {"medicine_id": "client-chosen-id", "user_id": "legacy-user"},
+    {"status": "missed", "notes": "felt dizzy"},
+    {"status": "delayed", "notes": ""},
+    {"status": "skipped"},
+    {"created_at": TAKEN_AT + timedelta(hours=2)},
+])
+def test_records_round_trip_unchanged(fields):
+    original = record(**fields)
+    assert decode_record(encode_record(original)) == original
+
+
+def test_optional_fields_are_omitted_only_when_absent():
+    document = encode_record(record())
+    assert "n" not in document and "c" not in document
+    assert encode_record(record(notes=""))["n"] == ""
+    assert "c" in encode_record(record(created_at=TAKEN_AT + timedelta(seconds=1)))
@@ -0,0 +1,154 @@
+import asyncio
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+from events import EventHub, LocalBroker, MongoBroker, Subscription  # noqa: E402
+
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+
+def test_subscription_drops_oldest_when_full():
+    async def scenario():
+        subscription = Subscription("u1", buffer_size=2)
+        for n in range(5):
+            subscription.offer({"n": n})
+        assert subscription.take_dropped() == 3
+        assert subscription.take_dropped() == 0
+        assert [(await subscription.get(0.1))["n"] for _ in range(2)] == [3, 4]
+        assert await subscription.get(0.01) is None
+        assert not subscription.closed
+
+    run(scenario())
+
+
+def test_publish_fans_out_to_each_recipient_connection():
+    async def scenario():
+        hub = EventHub(buffer_size=10)
+        first, second, family, stranger = (hub.subscribe(user) for user in ("u1", "u1", "u2", "u3"))
+        assert hub.connections == 4
+        await hub.publish("medicine.created", "u1", ["u1", "u2", "u1"], {"id": "m1"})
+        for subscription in (first, second, family):
+            event = await subscription.get(0.1)
+            assert (event["type"], event["user_id"], event["data"]) == ("medicine.created", "u1", {"id": "m1"})
+            assert event["recipients"] == ["u1", "u2"]
+        assert await stranger.get(0.01) is None
+
+        await hub.publish("medicine.updated", "u1", ["u1"], {})
+        assert (await first.get(0.1))["seq"] > event["seq"]
+
+    run(scenario())
+
+
+def test_unsubscribe_stops_delivery():
+    async def scenario():
+        hub = EventHub()
+        subscription = hub.subscribe("u1")
+        hub.unsubscribe(subscription)
+        hub.unsubscribe(subscription)
+        assert hub.connections == 0
+        await hub.publish("medicine.created", "u1", ["u1"], {})
+        assert await subscription.get(0.01) is None
+
+    run(scenario())
+
+
+def test_close_ends_every_subscription():
+    async def scenario():
+        broker = LocalBroker()
+        hub = EventHub(broker)
+        subscriptions = [hub.subscribe("u1"), hub.subscribe("u2")]
+        hub.close()
+        for subscription in subscriptions:
+            assert await subscription.get(0.1) is None
+            assert subscription.closed
+        assert hub not in broker.hubs
+
+    run(scenario())
+
+
+def test_hubs_on_one_broker_see_each_others_events():
+    async def scenario():
+        broker = LocalBroker()
+        one, other = EventHub(broker), EventHub(broker)
+        subscription = other.subscribe("u1")
+        await one.publish("medicine.deleted", "u1", ["u1"], {"id": "m1"})
+        assert (await subscription.get(0.1))["type"] == "medicine.deleted"
+
+    run(scenario())
+
+
+class FakeCursor:
+    """A tailable cursor over a list that grows while it is read."""
+
+    def __init__(self, documents):
+        self.documents = documents
+        self.position = 0
+        self.alive = True
+        self.closed = False
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if self.position < len(self.documents):
+            self.position += 1
+            return dict(self.documents[self.position - 1])
+        # An empty await batch: the loop ends but the cursor stays alive.
+        await asyncio.sleep(0.001)
+        raise StopAsyncIteration
+
+    async def close(self):
+        self.closed = True
+        self.alive = False
+
+
+class FakeCollection:
+    def __init__(self, documents):
+        self.documents = documents
+        self.cursors = []
+
+    async def find_one(self, query, projection=None):
+        return next((document for document in self.documents if document["_id"] == query["_id"]), None)
+
+    def find(self, query, cursor_type=None):
+        self.cursors.append(FakeCursor(self.documents))
+        return self.cursors[-1]
+
+
+def test_mongo_broker_tails_in_insertion_order_with_one_cursor():
+    async def scenario():
+        # Ids from different workers need not sort in insertion order.
+        documents = [{"_id": 9, "n": 0, "recipients": ["u1"]}]
+        collection = FakeCollection(documents)
+        broker = MongoBroker({"events": collection})
+        hub = EventHub(broker)
+        subscription = hub.subscribe("u1")
+        broker._tailer = asyncio.create_task(broker._tail(9))
+        for n, document_id in enumerate([3, 12, 1], start=1):
+            documents.append({"_id": document_id, "n": n, "recipients": ["u1"]})
+        assert [(await subscription.get(1))["n"] for _ in range(3)] == [1, 2, 3]
+        await asyncio.sleep(0.02)
+        assert len(collection.cursors) == 1
+
+        await broker.stop()
+        assert broker._tailer is None
+        assert collection.cursors[0].closed
+
+    run(scenario())
+
+
+def test_mongo_broker_delivers_everything_after_falling_behind():
+    async def scenario():
+        documents = [{"_id": n, "n": n, "recipients": ["u1"]} for n in (5, 6)]
+        broker = MongoBroker({"events": FakeCollection(documents)})
+        subscription = EventHub(broker).subscribe("u1")
+        # The last delivered event has been overwritten in the capped collection.
+        broker._tailer = asyncio.create_task(broker._tail(4))
+        assert [(await subscription.get(1))["n"] for _ in range(2)] == [5, 6]
+        await broker.stop()
+
+    run(scenario())
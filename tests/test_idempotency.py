@@ -0,0 +1,173 @@
+import asyncio
+import sys
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+mongomock_motor = pytest.importorskip("mongomock_motor")
+
+from idempotency import IdempotencyConflict, IdempotencyKeys, IdempotencyMismatch, fingerprint  # noqa: E402
+
+KEY = "user:medicines.create:key-1"
+REQUEST = fingerprint({"name": "Aspirin"})
+OTHER_REQUEST = fingerprint({"name": "Ibuprofen"})
+
+
+def run(scenario):
+    async def main():
+        collection = mongomock_motor.AsyncMongoMockClient().healthhub_test.idempotency_keys
+        await scenario(collection)
+    asyncio.run(main())
+
+
+class Handler:
+    def __init__(self, response=None, gate=None, error=None):
+        self.response = response or {"id": "m1"}
+        self.gate = gate
+        self.error = error
+        self.calls = 0
+
+    async def __call__(self):
+        self.calls += 1
+        if self.gate is not None:
+            await self.gate.wait()
+        if self.error is not None:
+            raise self.error
+        return self.response
+
+
+def test_concurrent_retries_share_one_run():
+    async def scenario(collection):
+        keys = IdempotencyKeys(collection)
+        handler = Handler(gate=asyncio.Event())
+        first = asyncio.ensure_future(keys.run(KEY, REQUEST, handler))
+        retry = asyncio.ensure_future(keys.run(KEY, REQUEST, handler))
+        await asyncio.sleep(0)
+        handler.gate.set()
+        assert await first == ({"id": "m1"}, False)
+        assert await retry == ({"id": "m1"}, True)
+        assert handler.calls == 1
+        assert (await collection.find_one({"_id": KEY}))["status"] == "completed"
+
+    run(scenario)
+
+
+def test_completed_key_replays_from_collection():
+    async def scenario(collection):
+        await IdempotencyKeys(collection).run(KEY, REQUEST, Handler())
+        # A new instance has an empty cache, like another server process.
+        handler = Handler({"id": "m2"})
+        assert await IdempotencyKeys(collection).run(KEY, REQUEST, handler) == ({"id": "m1"}, True)
+        assert handler.calls == 0
+
+    run(scenario)
+
+
+def test_key_reused_with_different_request_is_a_mismatch():
+    async def scenario(collection):
+        keys = IdempotencyKeys(collection)
+        await keys.run(KEY, REQUEST, Handler())
+        with pytest.raises(IdempotencyMismatch):
+            await keys.run(KEY, OTHER_REQUEST, Handler())
+        with pytest.raises(IdempotencyMismatch):
+            await IdempotencyKeys(collection).run(KEY, OTHER_REQUEST, Handler())
+
+    run(scenario)
+
+
+def test_mismatch_while_first_request_is_running():
+    async def scenario(collection):
+        keys = IdempotencyKeys(collection)
+        handler = Handler(gate=asyncio.Event())
+        first = asyncio.ensure_future(keys.run(KEY, REQUEST, handler))
+        retry = asyncio.ensure_future(keys.run(KEY, OTHER_REQUEST, handler))
+        await asyncio.sleep(0)
+        handler.gate.set()
+        assert (await first)[1] is False
+        with pytest.raises(IdempotencyMismatch):
+            await retry
+
+    run(scenario)
+
+
+def test_live_claim_elsewhere_is_a_conflict():
+    async def scenario(collection):
+        running = IdempotencyKeys(collection)
+        handler = Handler(gate=asyncio.Event())
+        first = asyncio.ensure_future(running.run(KEY, REQUEST, handler))
+        while await collection.find_one({"_id": KEY}) is None:
+            await asyncio.sleep(0)
+
+        other_process = IdempotencyKeys(collection)
+        with pytest.raises(IdempotencyConflict):
+            await other_process.run(KEY, REQUEST, Handler())
+        assert other_process.stats()["conflicts"] == 1
+
+        handler.gate.set()
+        await first
+        assert handler.calls == 1
+
+    run(scenario)
+
+
+def test_expired_claim_is_taken_over():
+    async def scenario(collection):
+        now = datetime.utcnow()
+        # Left behind by a request that crashed before finishing.
+        await collection.insert_one({
+            "_id": KEY,
+            "fingerprint": OTHER_REQUEST,
+            "status": "processing",
+            "locked_until": now - timedelta(seconds=1),
+            "created_at": now - timedelta(seconds=61),
+        })
+        handler = Handler()
+        assert await IdempotencyKeys(collection, lock_seconds=60).run(KEY, REQUEST, handler) == ({"id": "m1"}, False)
+        assert handler.calls == 1
+        stored = await collection.find_one({"_id": KEY})
+        assert (stored["status"], stored["fingerprint"], stored["response"]) == ("completed", REQUEST, {"id": "m1"})
+
+    run(scenario)
+
+
+def test_failed_request_releases_the_key():
+    async def scenario(collection):
+        keys = IdempotencyKeys(collection)
+        with pytest.raises(RuntimeError):
+            await keys.run(KEY, REQUEST, Handler(error=RuntimeError("insert failed")))
+        assert await collection.find_one({"_id": KEY}) is None
+
+        handler = Handler()
+        assert await keys.run(KEY, REQUEST, handler) == ({"id": "m1"}, False)
+        assert handler.calls == 1
+
+    run(scenario)
+
+
+def test_large_responses_are_replayed_from_the_collection():
+    async def scenario(collection):
+        keys = IdempotencyKeys(collection, cache_max_response_bytes=100)
+        image = {"id": "m1", "prescription_image": "x" * 1000}
+        await keys.run(KEY, REQUEST, Handler(image))
+        assert keys.stats()["entries"] == 0
+        handler = Handler()
+        assert await keys.run(KEY, REQUEST, handler) == (image, True)
+        assert handler.calls == 0
+
+    run(scenario)
+
+
+def test_cache_is_bounded_by_bytes():
+    async def scenario(collection):
+        keys = IdempotencyKeys(collection, cache_max_bytes=300, cache_max_response_bytes=100)
+        for n in range(5):
+            await keys.run(f"{KEY}:{n}", REQUEST, Handler({"id": f"m{n}", "notes": "y" * 60}))
+        stats = keys.stats()
+        assert stats["entries"] == 3
+        assert stats["cached_bytes"] <= 300
+        assert f"{KEY}:4" in keys._entries and f"{KEY}:0" not in keys._entries
+
+    run(scenario)
@@ -0,0 +1,104 @@
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+from interactions import InteractionIndex  # noqa: E402
+
+DATASET = {
+    "drugs": {
+        "amoxicillin": {"aliases": ["amoxil"], "classes": ["penicillins"]},
+        "cefalexin": {"aliases": ["keflex"], "classes": ["cephalosporins"]},
+        "warfarin": {"aliases": ["coumadin"], "classes": ["anticoagulants"]},
+        "ibuprofen": {"aliases": ["advil"], "classes": ["nsaids"]},
+        "aspirin": {"aliases": ["acetylsalicylic acid"], "classes": ["salicylates", "antiplatelets"]},
+    },
+    "allergens": {"penicillins": ["penicillin"], "nsaids": ["nsaid"]},
+    "cross_reactivity": [
+        {"a": "penicillins", "b": "cephalosporins", "severity": "moderate", "description": "beta-lactam"},
+        {"a": "nsaids", "b": "salicylates", "severity": "major", "description": "aspirin sensitivity"},
+    ],
+    "interactions": [
+        {"a": "anticoagulants", "b": "nsaids", "severity": "major", "description": "bleeding"},
+        {"a": "warfarin", "b": "ibuprofen", "severity": "minor", "description": "duplicate, milder"},
+        {"a": "anticoagulants", "b": "antiplatelets", "severity": "moderate", "description": "bleeding risk"},
+    ],
+}
+
+
+@pytest.fixture(scope="module")
+def index():
+    return InteractionIndex(DATASET)
+
+
+def name(index, text):
+    term_id = index.resolve(text)
+    return None if term_id is None else index.name_of(term_id)
+
+
+def test_resolves_aliases_and_longest_word_run(index):
+    assert name(index, "Amoxil 500mg") == "amoxicillin"
+    assert name(index, "AMOXICILLIN capsules") == "amoxicillin"
+    assert name(index, "acetylsalicylic acid 75 mg") == "aspirin"
+    assert name(index, "Take with acetylsalicylic acid") == "aspirin"
+    assert name(index, "vitamin c") is None
+    assert name(index, "") is None
+
+
+def test_direct_allergy_by_class(index):
+    warnings = index.check("Amoxil 500mg", ["Penicillin"])
+    assert [(w["type"], w["severity"]) for w in warnings] == [("allergy", "major")]
+
+
+def test_cross_reactivity_between_classes(index):
+    warnings = index.check("Keflex", ["penicillin"])
+    assert [(w["type"], w["severity"], w["description"]) for w in warnings] == [
+        ("cross_reactivity", "moderate", "beta-lactam"),
+    ]
+
+
+def test_cross_reactivity_from_drug_allergy(index):
+    # An allergy listed as a drug name reaches that drug's classes.
+    warnings = index.check("Advil", ["aspirin"])
+    assert [(w["type"], w["severity"]) for w in warnings] == [("cross_reactivity", "major")]
+
+
+def test_most_severe_interaction_wins(index):
+    warnings = index.check("Coumadin", None, [{"id": "m1", "name": "Advil 200mg"}])
+    assert len(warnings) == 1
+    assert warnings[0]["severity"] == "major"
+    assert warnings[0]["conflicts_with_id"] == "m1"
+    assert index.interaction(index.resolve("ibuprofen"), index.resolve("warfarin"))[0] == "major"
+
+
+def test_warnings_sorted_most_severe_first(index):
+    warnings = index.check("warfarin", None, [
+        {"id": "m1", "name": "aspirin"},
+        {"id": "m2", "name": "ibuprofen"},
+    ])
+    assert [w["severity"] for w in warnings] == ["major", "moderate"]
+
+
+def test_audit_reports_each_pair_once(index):
+    medicines = [
+        {"id": "m1", "name": "warfarin"},
+        {"id": "m2", "name": "ibuprofen"},
+        {"id": "m3", "name": "aspirin"},
+    ]
+    warnings = index.audit(["nsaid"], medicines)
+    pairs = [
+        frozenset((w["medicine_id"], w["conflicts_with_id"]))
+        for w in warnings if w["type"] == "interaction"
+    ]
+    assert len(pairs) == len(set(pairs))
+    assert set(pairs) == {frozenset(("m1", "m2")), frozenset(("m1", "m3"))}
+    allergies = [(w["medicine_id"], w["type"]) for w in warnings if w["type"] != "interaction"]
+    assert sorted(allergies) == [("m2", "allergy"), ("m3", "cross_reactivity")]
+
+
+def test_default_dataset_loads():
+    index = InteractionIndex.load()
+    assert index.size["terms"] and index.size["interactions"]
+    assert index.check("Coumadin", None, [{"id": "m1", "name": "Advil"}])
@@ -0,0 +1,138 @@
+import asyncio
+import sys
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+mongomock_motor = pytest.importorskip("mongomock_motor")
+
+from jobs import JobQueue  # noqa: E402
+
+
+def run(scenario):
+    async def main():
+        collection = mongomock_motor.AsyncMongoMockClient().healthhub_test.jobs
+        await scenario(collection)
+    asyncio.run(main())
+
+
+class Handler:
+    def __init__(self, failures=0, gate=None):
+        self.failures = failures
+        self.gate = gate
+        self.payloads = []
+
+    async def __call__(self, payload):
+        self.payloads.append(payload)
+        if self.gate is not None:
+            await self.gate.wait()
+        if len(self.payloads) <= self.failures:
+            raise RuntimeError(f"attempt {len(self.payloads)} failed")
+
+
+async def wait_for_status(collection, job_id, status):
+    for _ in range(500):
+        job = await collection.find_one({"_id": job_id})
+        if job["status"] == status:
+            return job
+        await asyncio.sleep(0.01)
+    raise AssertionError(f"job {job_id} is {job['status']}, expected {status}")
+
+
+def test_job_is_claimed_once_until_its_lease_expires():
+    async def scenario(collection):
+        queue = JobQueue(collection, {"note": Handler()}, lease_seconds=60)
+        other_process = JobQueue(collection, {"note": Handler()})
+        job_id = await queue.enqueue("note", {"n": 1})
+
+        job = await queue._claim(job_id)
+        assert (job["status"], job["attempts"]) == ("running", 1)
+        assert await other_process._claim(job_id) is None
+
+        # The first worker crashed; once the lease runs out the job is due again.
+        await collection.update_one({"_id": job_id}, {"$set": {"locked_until": datetime.utcnow() - timedelta(seconds=1)}})
+        job = await other_process._claim(job_id)
+        assert (job["status"], job["attempts"]) == ("running", 2)
+
+    run(scenario)
+
+
+def test_failed_job_is_retried_up_to_max_attempts():
+    async def scenario(collection):
+        handler = Handler(failures=10)
+        queue = JobQueue(collection, {"note": handler}, workers=2, max_attempts=3,
+                         backoff_seconds=0, poll_interval_seconds=0.01)
+        await queue.start()
+        job_id = await queue.enqueue("note", {"n": 1})
+        job = await wait_for_status(collection, job_id, "failed")
+        await queue.stop(drain_timeout=1)
+
+        assert job["attempts"] == 3 and len(handler.payloads) == 3
+        assert job["last_error"] == repr(RuntimeError("attempt 3 failed"))
+        stats = queue.stats()
+        assert (stats["completed"], stats["retried"], stats["failed"]) == (0, 2, 1)
+
+    run(scenario)
+
+
+def test_job_succeeds_after_a_retry():
+    async def scenario(collection):
+        handler = Handler(failures=1)
+        queue = JobQueue(collection, {"note": handler}, backoff_seconds=0, poll_interval_seconds=0.01)
+        await queue.start()
+        job_id = await queue.enqueue("note", {"n": 1})
+        job = await wait_for_status(collection, job_id, "done")
+        await queue.stop(drain_timeout=1)
+        assert job["attempts"] == 2 and "locked_until" not in job
+        assert queue.stats()["completed"] == 1
+
+    run(scenario)
+
+
+def test_stop_drains_queued_jobs():
+    async def scenario(collection):
+        handler = Handler(gate=asyncio.Event())
+        queue = JobQueue(collection, {"note": handler}, workers=2)
+        await queue.start()
+        job_ids = [await queue.enqueue("note", {"n": n}) for n in range(5)]
+        asyncio.get_running_loop().call_later(0.05, handler.gate.set)
+        await queue.stop(drain_timeout=5)
+        assert [job["status"] async for job in collection.find({"_id": {"$in": job_ids}})] == ["done"] * 5
+        assert queue._tasks == []
+
+    run(scenario)
+
+
+def test_stop_leaves_unfinished_jobs_in_the_collection():
+    async def scenario(collection):
+        queue = JobQueue(collection, {"note": Handler(gate=asyncio.Event())}, workers=1)
+        await queue.start()
+        job_ids = [await queue.enqueue("note", {"n": n}) for n in range(2)]
+        await queue.stop(drain_timeout=0.05)
+        # One was interrupted mid-run and is picked up when its lease
+        # expires; the other never started.
+        statuses = {job["_id"]: job["status"] async for job in collection.find({"_id": {"$in": job_ids}})}
+        assert statuses == {job_ids[0]: "running", job_ids[1]: "pending"}
+
+        handler = Handler()
+        restarted = JobQueue(collection, {"note": handler}, poll_interval_seconds=0.01)
+        await collection.update_one({"_id": job_ids[0]}, {"$set": {"locked_until": datetime.utcnow()}})
+        await restarted.start()
+        for job_id in job_ids:
+            await wait_for_status(collection, job_id, "done")
+        await restarted.stop(drain_timeout=1)
+        assert sorted(payload["n"] for payload in handler.payloads) == [0, 1]
+
+    run(scenario)
+
+
+def test_unknown_kind_is_rejected():
+    async def scenario(collection):
+        with pytest.raises(ValueError):
+            await JobQueue(collection, {}).enqueue("note", {})
+        assert await collection.count_documents({}) == 0
+
+    run(scenario)
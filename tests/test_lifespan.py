@@ -0,0 +1,44 @@
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+mongomock_motor = pytest.importorskip("mongomock_motor")
+pytest.importorskip("httpx")
+
+from fastapi.testclient import TestClient  # noqa: E402
+
+import server  # noqa: E402
+
+
+class Client(mongomock_motor.AsyncMongoMockClient):
+    closed = False
+
+    def close(self):
+        self.closed = True
+
+
+def test_client_is_closed_when_startup_fails(monkeypatch):
+    mongo = Client()
+    monkeypatch.setattr(server, "connect", lambda settings: mongo)
+
+    async def unreachable(*args):
+        raise ConnectionError("no primary")
+    monkeypatch.setattr(server, "warm_up_pool", unreachable)
+    app = server.create_app(server.Settings(mongo_url="mongodb://in-memory", db_name="healthhub_test"))
+    with pytest.raises(ConnectionError):
+        with TestClient(app):
+            pass
+    assert mongo.closed
+
+
+def test_factory_reads_settings_when_called(monkeypatch):
+    monkeypatch.setattr(server.Settings, "load_dotenv", staticmethod(lambda: None))
+    monkeypatch.setenv("MONGO_URL", "mongodb://in-memory")
+    monkeypatch.setenv("DB_NAME", "healthhub_test")
+    monkeypatch.setenv("CORS_ORIGINS", "https://a.example,https://b.example")
+    app = server.create_app()
+    assert app.state.settings.cors_origins == ["https://a.example", "https://b.example"]
+    assert not hasattr(server, "app")
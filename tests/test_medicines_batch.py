@@ -0,0 +1,88 @@
+import sys
+import uuid
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+mongomock_motor = pytest.importorskip("mongomock_motor")
+pytest.importorskip("httpx")
+
+from fastapi.testclient import TestClient  # noqa: E402
+
+import server  # noqa: E402
+
+
+@pytest.fixture
+def client(monkeypatch):
+    mongo = mongomock_motor.AsyncMongoMockClient()
+    monkeypatch.setattr(server, "connect", lambda settings: mongo)
+
+    async def warm_up_pool(*args):
+        pass
+    monkeypatch.setattr(server, "warm_up_pool", warm_up_pool)
+    settings = server.Settings(mongo_url="mongodb://in-memory", db_name="healthhub_test", report_interval_seconds=0)
+    with TestClient(server.create_app(settings)) as client:
+        yield client
+
+
+def login(client, email):
+    response = client.post("/api/auth/register", json={"email": email, "password": "pw", "full_name": email})
+    assert response.status_code == 200, response.text
+    return {"Authorization": f"Bearer {response.json()['token']}"}
+
+
+def medicine(name, **fields):
+    return {"name": name, "dosage": "10mg", "frequency": "daily", **fields}
+
+
+def test_batch_creates_updates_and_reports_failures(client, monkeypatch):
+    alice = login(client, "alice@example.com")
+    bob = login(client, "bob@example.com")
+    aspirin = client.post("/api/medicines", json=medicine("Aspirin"), headers=alice).json()["id"]
+    bobs = client.post("/api/medicines", json=medicine("Warfarin"), headers=bob).json()["id"]
+
+    invalidated = []
+    data_changed = server.data_changed
+
+    def counting_data_changed(*user_ids):
+        invalidated.append(user_ids)
+        data_changed(*user_ids)
+    monkeypatch.setattr(server, "data_changed", counting_data_changed)
+
+    response = client.post("/api/medicines/batch", headers=alice, json=[
+        medicine("Ibuprofen"),
+        medicine("Aspirin", dosage="75mg", id=aspirin),
+        medicine("Aspirin", dosage="300mg", id=aspirin),
+        medicine("Warfarin", id=bobs),
+        medicine("Paracetamol", id=str(uuid.uuid4())),
+        medicine("Metformin", id="not-a-uuid"),
+    ])
+    assert response.status_code == 200, response.text
+    body = response.json()
+    assert [(result["status"], result["error"]) for result in body["results"]] == [
+        ("created", None),
+        ("updated", None),
+        ("failed", "Medicine appears more than once in the batch"),
+        ("failed", "Medicine not found"),
+        ("failed", "Medicine not found"),
+        ("failed", "Invalid medicine id"),
+    ]
+    assert (body["created"], body["updated"], body["failed"]) == (1, 1, 4)
+    assert len(invalidated) == 1
+
+    names = sorted((m["name"], m["dosage"]) for m in client.get("/api/medicines", headers=alice).json())
+    assert names == [("Aspirin", "75mg"), ("Ibuprofen", "10mg")]
+    # Another user's id can be neither taken over nor overwritten.
+    assert client.get(f"/api/medicines/{bobs}", headers=bob).json()["name"] == "Warfarin"
+    assert client.get(f"/api/medicines/{bobs}", headers=alice).status_code == 404
+
+
+def test_batch_of_failures_writes_nothing(client, monkeypatch):
+    alice = login(client, "alice@example.com")
+    invalidated = []
+    monkeypatch.setattr(server, "data_changed", lambda *user_ids: invalidated.append(user_ids))
+    body = client.post("/api/medicines/batch", headers=alice, json=[medicine("Aspirin", id="m1")]).json()
+    assert (body["created"], body["updated"], body["failed"]) == (0, 0, 1)
+    assert invalidated == []
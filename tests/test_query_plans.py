@@ -0,0 +1,275 @@
+"""Query-plan regression tests against a local MongoDB.
+
+Seeds a scratch database per health record layout with ``seed_data`` and
+runs every query the server issues through ``explain``. A query fails if
+its plan contains a COLLSCAN or it examines far more documents than it
+matches. Uses MONGO_TEST_URL (default ``mongodb://localhost:27017``) and
+is skipped when no server answers there.
+"""
+
+import asyncio
+import os
+import sys
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+pymongo = pytest.importorskip("pymongo")
+pytest.importorskip("motor")
+
+from pymongo.errors import PyMongoError  # noqa: E402
+
+import jobs  # noqa: E402
+import reports  # noqa: E402
+
+MONGO_URL = os.environ.get("MONGO_TEST_URL", "mongodb://localhost:27017")
+DB_PREFIX = "healthhub_query_plans"
+UNTIL = datetime(2025, 1, 1)
+ARCHIVE_CUTOFF = UNTIL - timedelta(days=120)
+MAX_EXAMINED_RATIO = 2
+EXAMINED_SLACK = 10
+STORAGE_MODES = ["collection", "compact", "buckets", "timeseries"]
+
+
+@pytest.fixture(scope="module")
+def mongo():
+    client = pymongo.MongoClient(MONGO_URL, serverSelectionTimeoutMS=1000)
+    try:
+        client.admin.command("ping")
+    except PyMongoError:
+        pytest.skip(f"no MongoDB at {MONGO_URL}")
+    yield client
+    for mode in STORAGE_MODES:
+        client.drop_database(f"{DB_PREFIX}_{mode}")
+    client.close()
+
+
+async def _seed(mode: str):
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    import seed_data
+    import server
+    from archive import HealthHistory, MongoSegmentArchive
+    from idempotency import IdempotencyKeys
+    from jobs import JobQueue
+    from record_store import make_record_store
+    from reports import AnalyticsReports
+
+    client = AsyncIOMotorClient(MONGO_URL)
+    database = client[f"{DB_PREFIX}_{mode}"]
+    await client.drop_database(database.name)
+    store = make_record_store(database, mode)
+    archive = MongoSegmentArchive(database)
+    await server.ensure_indexes(database)
+    await store.setup()
+    await archive.setup()
+    await JobQueue(database.jobs, {}).setup()
+    reports = AnalyticsReports(database, store)
+    await reports.setup()
+    await IdempotencyKeys(database.idempotency_keys).setup()
+
+    await seed_data.generate(database, store, users=60, medicines_per_user=3, family_size=4,
+                             years=0.5, until=UNTIL, batch_size=5000)
+    await database.jobs.insert_many([
+        {"_id": f"job-{n}", "kind": "family.invite", "payload": {}, "attempts": 1,
+         "status": "done" if n % 4 else "pending", "run_at": UNTIL, "created_at": UNTIL}
+        for n in range(200)
+    ])
+    user = await database.users.find_one({"email": "user0000001@example.com"})
+    await HealthHistory(store, archive, 1).archive_user(user["id"], ARCHIVE_CUTOFF)
+    await reports.refresh()
+    client.close()
+
+
+@pytest.fixture(scope="module")
+def databases(mongo):
+    seeded = {}
+
+    def get(mode: str):
+        if mode not in seeded:
+            asyncio.run(_seed(mode))
+            database = mongo[f"{DB_PREFIX}_{mode}"]
+            user = database.users.find_one({"email": "user0000001@example.com"})
+            medicine = database.medicines.find_one({"user_id": user["id"]})
+            seeded[mode] = (database, {"user": user, "medicine": medicine})
+        return seeded[mode]
+    return get
+
+
+def _explain(database, command):
+    return database.command("explain", command, verbosity="executionStats")
+
+
+def _walk(node):
+    if isinstance(node, dict):
+        yield node
+        for value in node.values():
+            yield from _walk(value)
+    elif isinstance(node, list):
+        for value in node:
+            yield from _walk(value)
+
+
+def _assert_efficient(database, name, command, collection, count_filter, limit=None):
+    explained = _explain(database, command)
+    stages = {node["stage"] for node in _walk(explained) if isinstance(node.get("stage"), str)}
+    assert "COLLSCAN" not in stages, f"{name} scans the whole collection: {stages}"
+
+    examined = max(
+        (node["totalDocsExamined"] for node in _walk(explained) if "totalDocsExamined" in node),
+        default=0,
+    )
+    matched = database[collection].count_documents(count_filter)
+    if limit:
+        matched = min(matched, limit)
+    allowed = matched * MAX_EXAMINED_RATIO + EXAMINED_SLACK
+    assert examined <= allowed, f"{name} examined {examined} documents to match {matched}"
+
+
+def server_queries(ctx):
+    """Every query in server.py, as (collection, command, count filter, limit).
+
+    Filters come from the same helpers the routes and modules use, so the
+    test follows them when they change.
+    """
+    import server
+    from archive import MongoSegmentArchive
+
+    user, medicine = ctx["user"], ctx["medicine"]
+    family = user["family_members"]
+    now = UNTIL
+    user_medicines = server.user_medicines_query(user["id"])
+    other_medicines = server.user_medicines_query(user["id"], medicine["id"])
+    medicine_key = server.medicine_key(user["id"], medicine["id"])
+    expiry_window = server.expiring_medicines_query(user["id"], now)
+    due_jobs = jobs.due_query(now)
+    archive_window = MongoSegmentArchive._months_query(user["id"], UNTIL - timedelta(days=365), UNTIL)
+    segment_id = MongoSegmentArchive._segment_id(user["id"], ARCHIVE_CUTOFF)
+    idempotency_key = server.idempotency_key(user["id"], "medicines.create", "k")
+    expiries = reports.expiries_pipeline(now, now + timedelta(days=365), now)
+    stockouts = reports.stockouts_pipeline(now, now)
+    report_days = reports.view_query(now - timedelta(days=30), now)
+    stale_rows = reports.stale_rows_query(now - timedelta(days=30), now)
+    return {
+        "users by email (auth, register, login, invite)": (
+            "users", {"find": "users", "filter": {"email": user["email"]}, "limit": 1},
+            {"email": user["email"]}, 1),
+        "medicines by user (list, batch, interactions)": (
+            "medicines", {"find": "medicines", "filter": user_medicines}, user_medicines, None),
+        "other medicines of user (update interactions)": (
+            "medicines", {"find": "medicines", "filter": other_medicines}, other_medicines, None),
+        "medicine by id": (
+            "medicines", {"find": "medicines", "filter": medicine_key, "limit": 1}, medicine_key, 1),
+        "update medicine": (
+            "medicines",
+            {"update": "medicines", "updates": [{"q": medicine_key, "u": {"$set": {"stock_quantity": 1}}}]},
+            medicine_key, 1),
+        "batch upsert medicine": (
+            "medicines",
+            {"update": "medicines", "updates": [{"q": medicine_key, "u": {"$set": {"dosage": "1mg"}}, "upsert": True}]},
+            medicine_key, 1),
+        "delete medicine": (
+            "medicines", {"delete": "medicines", "deletes": [{"q": medicine_key, "limit": 1}]}, medicine_key, 1),
+        "family members": (
+            "users", {"find": "users", "filter": {"id": {"$in": family}}}, {"id": {"$in": family}}, None),
+        "family audit medicines": (
+            "medicines", {"find": "medicines", "filter": {"user_id": {"$in": [user["id"]] + family}}},
+            {"user_id": {"$in": [user["id"]] + family}}, None),
+        "family link": (
+            "users",
+            {"update": "users", "updates": [{"q": {"id": user["id"]}, "u": {"$addToSet": {"family_members": "x"}}}]},
+            {"id": user["id"]}, 1),
+        "family invite upsert": (
+            "family_invites",
+            {"update": "family_invites", "updates": [{"q": {"id": "missing"}, "u": {"id": "missing"}, "upsert": True}]},
+            {"id": "missing"}, 1),
+        "upcoming expiries": (
+            "medicines",
+            {"find": "medicines", "filter": expiry_window, "sort": {"expiry_date": 1}, "limit": 100},
+            expiry_window, 100),
+        "job poll": (
+            "jobs", {"find": "jobs", "filter": due_jobs, "projection": {"_id": 1}, "limit": 100}, due_jobs, 100),
+        "job claim": (
+            "jobs",
+            {"findAndModify": "jobs", "query": dict(due_jobs, _id="job-0"), "update": {"$inc": {"attempts": 1}}},
+            dict(due_jobs, _id="job-0"), 1),
+        "archived months": (
+            "health_record_archive",
+            {"find": "health_record_archive", "filter": archive_window, "sort": {"month": -1}},
+            archive_window, None),
+        "archived segment": (
+            "health_record_archive",
+            {"find": "health_record_archive", "filter": {"_id": segment_id}, "limit": 1}, {"_id": segment_id}, 1),
+        "idempotency key": (
+            "idempotency_keys", {"find": "idempotency_keys", "filter": {"_id": idempotency_key}},
+            {"_id": idempotency_key}, 1),
+        # $merge cannot be explained with execution stats; the read side is what matters.
+        "expiry view refresh": (
+            "medicines", {"aggregate": "medicines", "pipeline": expiries[:-1], "cursor": {}},
+            expiries[0]["$match"], None),
+        "stock-out view refresh": (
+            "medicines", {"aggregate": "medicines", "pipeline": stockouts[:-1], "cursor": {}},
+            stockouts[0]["$match"], None),
+        "stale view rows": (
+            reports.EXPIRIES_VIEW,
+            {"delete": reports.EXPIRIES_VIEW, "deletes": [{"q": stale_rows, "limit": 0}]},
+            stale_rows, None),
+        "admin report read": (
+            reports.ADHERENCE_VIEW,
+            {"find": reports.ADHERENCE_VIEW, "filter": report_days, "sort": {"day": 1, "category": 1}},
+            report_days, None),
+    }
+
+
+def store_queries(store, ctx):
+    """The queries a health record store issues, for its own layout."""
+    user = ctx["user"]
+    name = store.collection_name
+    since = UNTIL - timedelta(days=30)
+    query = store._bucket_query if store.mode == "buckets" else store._query
+    history, recent = query(user["id"], None, None), query(user["id"], since, UNTIL)
+    month = datetime(UNTIL.year - 1, 11, 1)
+    delete = store._delete_query(user["id"], ["missing"], month, datetime(UNTIL.year - 1, 12, 1))
+    due = store._archival_query(ARCHIVE_CUTOFF)
+    queries = {
+        "history": (name, {"find": name, "filter": history, "sort": {store.time_field: -1}, "limit": 1000},
+                    history, 1000),
+        "history range": (name, {"find": name, "filter": recent, "sort": {store.time_field: -1}}, recent, None),
+        "status counts": (name, {"aggregate": name, "pipeline": [
+            {"$match": recent}, {"$group": {"_id": None, "count": {"$sum": 1}}}], "cursor": {}}, recent, None),
+        "archival users": (name, {"distinct": name, "key": store.user_field, "query": due}, due, None),
+        "archival delete": (name, {"delete": name, "deletes": [{"q": delete, "limit": 0}]}, delete, None),
+    }
+    adherence = reports.adherence_pipeline(store, since, UNTIL, UNTIL)
+    queries["adherence view refresh"] = (
+        name, {"aggregate": name, "pipeline": adherence[:-1], "cursor": {}}, adherence[0]["$match"], None)
+    return queries
+
+
+SERVER_QUERIES = list(server_queries({"user": {"id": "u", "email": "e", "family_members": []},
+                                      "medicine": {"id": "m"}}))
+STORE_QUERIES = ["history", "history range", "status counts", "archival users", "archival delete",
+                 "adherence view refresh"]
+
+
+@pytest.mark.parametrize("name", SERVER_QUERIES)
+def test_server_query_uses_index(databases, name):
+    database, ctx = databases("collection")
+    collection, command, count_filter, limit = server_queries(ctx)[name]
+    _assert_efficient(database, name, command, collection, count_filter, limit)
+
+
+@pytest.mark.parametrize("mode", STORAGE_MODES)
+@pytest.mark.parametrize("name", STORE_QUERIES)
+def test_record_store_query_uses_index(databases, mode, name):
+    from record_store import make_record_store
+
+    database, ctx = databases(mode)
+    queries = store_queries(make_record_store(database, mode), ctx)
+    if name not in queries:
+        pytest.skip(f"{mode} layout does not issue {name}")
+    collection, command, count_filter, limit = queries[name]
+    _assert_efficient(database, f"{mode}: {name}", command, collection, count_filter, limit)
@@ -0,0 +1,125 @@
+import asyncio
+import sys
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+mongomock_motor = pytest.importorskip("mongomock_motor")
+
+import reports  # noqa: E402
+from record_store import HealthRecordStore  # noqa: E402
+from reports import ADHERENCE_VIEW, EXPIRIES_VIEW, RUN_ID, STOCKOUTS_VIEW, AnalyticsReports  # noqa: E402
+
+NOW = datetime(2025, 3, 10, 15, 30)
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [NOW]
+
+    class FrozenDatetime(datetime):
+        @classmethod
+        def utcnow(cls):
+            return now[0]
+    monkeypatch.setattr(reports, "datetime", FrozenDatetime)
+    return now
+
+
+class Reports(AnalyticsReports):
+    """Records each view rebuild instead of running its pipeline; mongomock has no $merge."""
+
+    def __init__(self, database, **kwargs):
+        super().__init__(database, HealthRecordStore(database), **kwargs)
+        self.rebuilt = []
+        self.error = None
+
+    async def _rebuild(self, source, view, pipeline, since, built_at):
+        if self.error is not None:
+            raise self.error
+        self.rebuilt.append((view, since))
+
+
+def run(scenario, **kwargs):
+    async def main():
+        database = mongomock_motor.AsyncMongoMockClient().healthhub_test
+        await scenario(Reports(database, **kwargs))
+    asyncio.run(main())
+
+
+def test_adherence_since_without_archival_is_unchanged():
+    report = AnalyticsReports(mongomock_motor.AsyncMongoMockClient().healthhub_test, None)
+    assert report._adherence_since(None, NOW) is None
+    assert report._adherence_since(datetime(2020, 1, 1), NOW) == datetime(2020, 1, 1)
+
+
+def test_adherence_since_stays_clear_of_archived_days():
+    report = AnalyticsReports(mongomock_motor.AsyncMongoMockClient().healthhub_test, None, archive_after_days=30)
+    # The archiver may have moved doses up to 2025-02-08 15:30, so that
+    # whole day is partly archived and left as last built.
+    live = datetime(2025, 2, 9)
+    assert report._adherence_since(None, NOW) == live
+    assert report._adherence_since(datetime(2025, 1, 1), NOW) == live
+    assert report._adherence_since(datetime(2025, 3, 7), NOW) == datetime(2025, 3, 7)
+
+
+def test_first_refresh_builds_everything_then_only_recent_days(clock):
+    async def scenario(report):
+        assert await report.refresh()
+        assert report.rebuilt == [(ADHERENCE_VIEW, None), (EXPIRIES_VIEW, None), (STOCKOUTS_VIEW, datetime(2025, 3, 10))]
+        state = await report.runs.find_one({"_id": RUN_ID})
+        assert state["watermark"] == NOW and "running_until" not in state
+
+        report.rebuilt = []
+        clock[0] = NOW + timedelta(days=1)
+        assert await report.refresh()
+        # Dose days from the previous watermark minus the lookback.
+        assert report.rebuilt == [
+            (ADHERENCE_VIEW, datetime(2025, 3, 8)),
+            (EXPIRIES_VIEW, datetime(2025, 3, 11)),
+            (STOCKOUTS_VIEW, datetime(2025, 3, 11)),
+        ]
+        assert (await report.status())["refreshed_at"] == NOW + timedelta(days=1)
+
+    run(scenario, lookback_days=2)
+
+
+def test_refresh_with_archival_skips_archived_days(clock):
+    async def scenario(report):
+        await report.refresh()
+        assert report.rebuilt[0] == (ADHERENCE_VIEW, datetime(2025, 2, 9))
+
+        report.rebuilt = []
+        clock[0] = NOW + timedelta(days=1)
+        await report.refresh()
+        assert report.rebuilt[0] == (ADHERENCE_VIEW, datetime(2025, 3, 8))
+
+    run(scenario, lookback_days=2, archive_after_days=30)
+
+
+def test_refresh_skips_while_another_worker_holds_the_lease(clock):
+    async def scenario(report):
+        await report.runs.insert_one({"_id": RUN_ID, "running_until": NOW + timedelta(minutes=5)})
+        assert not await report.refresh()
+        assert report.rebuilt == []
+
+        clock[0] = NOW + timedelta(minutes=6)
+        assert await report.refresh()
+
+    run(scenario)
+
+
+def test_failed_refresh_releases_the_lease_and_keeps_the_watermark(clock):
+    async def scenario(report):
+        await report.refresh()
+        report.error = RuntimeError("merge failed")
+        clock[0] = NOW + timedelta(hours=1)
+        with pytest.raises(RuntimeError):
+            await report.refresh()
+        status = await report.status()
+        assert (status["refreshed_at"], status["running"]) == (NOW, False)
+        assert status["last_error"] == repr(RuntimeError("merge failed"))
+
+    run(scenario)